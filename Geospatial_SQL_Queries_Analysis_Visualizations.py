@@ -1,5 +1,3 @@
-
-
 # ### Loading the Dataset CSV file
 # 
 # Three datasets are need for this project:
@@ -43,12 +41,21 @@
 
 import folium
 from folium import plugins
-from folium.plugins import MarkerCluster
 import psycopg2
 import csv
 import pandas as pd
-import json
-from area import area
+
+import boundary_cache
+import crime_queries
+import crime_report
+import crime_rollups
+import hotspot_grid
+import map_export
+import map_rendering
+import marker_clusters
+import query_cache
+import query_profiler
+import report_runner
 
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT 
 
@@ -58,10 +65,24 @@ from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 
 
 
-db_connection = psycopg2.connect(host='129.105.208.229',dbname="chicago_crimes", user="username" , password="password")
+report_pool = report_runner.connect_pool(maxconn=8, host='129.105.208.229',dbname="chicago_crimes", user="username" , password="password")
+
+report_runner.run_on_pool(report_pool, crime_report.prepare_database)
+
+crime_queries.STRICT_PLANS = True
+crime_queries.CACHE = query_cache.QueryCache(directory='.query_cache')
 
+# Time every statement and section; EXPLAIN (ANALYZE, BUFFERS) the statements slower than 60 seconds
+profiler = query_profiler.Profiler(explain_slower_than=60)
+crime_queries.PROFILER = profiler
 
-cursor = db_connection.cursor()
+district_boundaries = boundary_cache.load('Boundaries.geojson')
+
+# The eight maps are rendered in parallel to HTML files in MAP_DIRECTORY (see the end of the script)
+MAP_DIRECTORY = 'maps'
+
+# Set to a directory to also write every map in export mode (see the end of the script)
+EXPORT_DIRECTORY = None
 
 
 # ### Chicago Crimes Dataset
@@ -73,6 +94,9 @@ cursor = db_connection.cursor()
 # 1. We are interested in the data set of the past 2 years, and when you execute Geospatial type queries, please be advised that these queries slow down your machine. 
 # 2. Running this script to work on the data of the past 2 years will require roughly 25 minutes to complete. And requires roughly 40 minutes to complete using the dataset of the past 5 years. And requires hours to complete on the entire dataset with at least 16GB memory.
 # 3. It is a good idea to take a slice (past two years) of the dataset and store it, that will help improve perfoamnce significantly especialy for SEARCH and SORT algorithms that are utilized by the database engine.
+# 4. **crime_rollups.refresh** (In[2]) does exactly that: it keeps the past two years in `recent_crimes` together with pre-aggregated counts, and only appends the crimes that arrived since the last run. Queries #1 to #5 and Requirements #1, #2 and #4 read from those tables.
+# 5. The densities of Query #4 and Requirement #2 can also be computed offline, for any boundary file (beats, wards, a re-districting), from an extract of the crimes: `spatial_join.load('Boundaries.geojson')` assigns latitude/longitude points to its polygons and `spatial_join.density` divides the counts by the polygon areas.
+# 6. The timings above come from the university server. `python -m benchmarks.run_report --dsn ...` loads synthetic crimes of 1M, 6.5M and 20M rows into a scratch PostGIS database and records the latency, rows and peak memory of every section below, to compare changes on scaling curves.
 # 
 # 
 # ### Algorithm Performance
@@ -85,6 +109,19 @@ cursor = db_connection.cursor()
 # 
 
 # ## Lets start executing different  Queries
+# 
+# The queries behind the different sections are independent of each other, so they all run concurrently, each on its own connection from the pool. The sections below build their maps from the `report` results.
+
+# In[ ]:
+
+
+violent_crime_categories = crime_report.VIOLENT_CRIME_CATEGORIES
+
+# The queries of every section are listed in crime_report, shared with benchmarks/run_report.py
+profiler.enter('Report queries')
+report = report_runner.run_queries(report_pool, profiler.wrap_all(crime_report.queries()))
+
+police_stations = report['police_stations']
 
 # ## Query #1:
 # - Calculate the total number of crimes in every district and plot that on Choropleth map
@@ -92,8 +129,8 @@ cursor = db_connection.cursor()
 # In[3]:
 
 
-cursor.execute("SELECT district, count(district) from crimes GROUP BY district")
-rows=cursor.fetchall()
+profiler.enter('Query #1')
+rows=list(report['crimes_per_district'].items())
 
 
 # In[4]:
@@ -108,34 +145,25 @@ crimes_per_district.head()
 # In[5]:
 
 
-total_number_of_crimes_per_district_map = folium.Map(location =(41.8781, -87.6298),zoom_start=11)
+total_number_of_crimes_per_district_map = map_rendering.MapSpec('total_number_of_crimes_per_district')
 
 
 # In[6]:
 
 
-total_number_of_crimes_per_district_map.choropleth(geo_data="Boundaries.geojson", 
-              fill_color='OrRd', 
-              fill_opacity=0.5, 
-              line_opacity=1,
-              data = crimes_per_district,
-              key_on='feature.properties.dist_num',
-              columns = ['dist_num', 'number_of_crimes']
-              )
+total_number_of_crimes_per_district_map.choropleth(crimes_per_district, ['dist_num', 'number_of_crimes'], 'OrRd')
 
 
 # In[7]:
 
 
-cursor.execute("""SELECT ST_X(ST_AsText(Where_IS)), ST_Y(ST_AsText(Where_IS)), district from police_stations where district!='Headquarters'""")
-police_stations = cursor.fetchall()
+districts_crime_numbers = report['crimes_per_district']
 
 for police_station in police_stations:
     police_station_location = (police_station[0],police_station[1])
-    cursor.execute("SELECT district, count(district) from crimes where district= %s GROUP BY district",[police_station[2]])
-    districts_crime_numbers = cursor.fetchall()
-    for district in districts_crime_numbers:
-        folium.Marker(location = police_station_location,popup=folium.Popup(html="District No : %s  has   Total Number of Crimes:%s" %district ,max_width=450)).add_to(total_number_of_crimes_per_district_map)
+    district = crime_queries.district_key(police_station[2])
+    if district in districts_crime_numbers:
+        total_number_of_crimes_per_district_map.marker(police_station_location, "District No : %s  has   Total Number of Crimes:%s" %(police_station[2],districts_crime_numbers[district]), max_width=450)
 
 
 # - **Lets plot the Choropleth map and notice  the intensity of color on the different districts**
@@ -158,14 +186,14 @@ total_number_of_crimes_per_district_map
 # In[9]:
 
 
-violent_crime_categories='THEFT','ASSAULT','ROBBERY','KIDNAPPING','CRIM SEXUAL ASSAULT','BATTERY','MURDER'
+profiler.enter('Query #2')
+violent_crime_categories
 
 
 # In[10]:
 
 
-cursor.execute("SELECT district, count(district) from crimes where PRIMARY_TYPE in %s GROUP BY district",[violent_crime_categories])
-rows=cursor.fetchall()
+rows=list(report['violent_crimes_per_district'].items())
 violent_crime_data=pd.DataFrame(rows, columns=['district_num','number_of_violent_crimes'])
 violent_crime_data['district_num'] = violent_crime_data['district_num'].astype(str)
 violent_crime_data
@@ -174,31 +202,20 @@ violent_crime_data
 # In[11]:
 
 
-violent_crimes_per_district_map= folium.Map(location =(41.8781, -87.6298),zoom_start=11)
-violent_crimes_per_district_map.choropleth(geo_data="Boundaries.geojson", 
-              fill_color='YlOrRd', 
-              fill_opacity=0.5, 
-              line_opacity=1,
-              data = violent_crime_data,
-              key_on='feature.properties.dist_num',
-              columns = ['district_num', 'number_of_violent_crimes'],
-              legend_name="VOILENT CRIME MAP"
-              )
+violent_crimes_per_district_map = map_rendering.MapSpec('violent_crimes_per_district')
+violent_crimes_per_district_map.choropleth(violent_crime_data, ['district_num', 'number_of_violent_crimes'], 'YlOrRd', "VOILENT CRIME MAP")
 
 
 # In[12]:
 
 
-cursor.execute("""SELECT ST_X(ST_AsText(Where_IS)), ST_Y(ST_AsText(Where_IS)), district from police_stations where district!='Headquarters'""")
-police_stations = cursor.fetchall()
+violent_crimes_by_district = report['violent_crime_types']
 
 for police_station in police_stations:
     police_station_location =(police_station[0],police_station[1])
-    cursor.execute("SELECT PRIMARY_TYPE, count(PRIMARY_TYPE) from crimes where district =%s AND PRIMARY_TYPE in %s GROUP BY PRIMARY_TYPE",[police_station[2],violent_crime_categories])
-    data = cursor.fetchall()
-    violent_crimes_per_district_df = pd.DataFrame(data, columns=['Description', 'Number of Violent Crimes'])
-    header = violent_crimes_per_district_df.to_html(classes='table table-striped table-hover table-condensed table-responsive')
-    folium.Marker(location=police_station_location, popup=folium.Popup(html="District Number %s - Violent Crimes %s" %(police_station[2],header))).add_to(violent_crimes_per_district_map)
+    data = violent_crimes_by_district.get(crime_queries.district_key(police_station[2]), [])
+    # The popup table comes from a precompiled template rather than a DataFrame.to_html round trip
+    violent_crimes_per_district_map.marker(police_station_location, map_rendering.table_popup("District Number %s - Violent Crimes" %police_station[2], data, ['Description', 'Number of Violent Crimes']))
 
 
 
@@ -218,10 +235,9 @@ violent_crimes_per_district_map
 # In[14]:
 
 
+profiler.enter('Query #3')
 
-gun='%GUN%'
-cursor.execute("SELECT district, count(district) from crimes where DESCRIPTION::text LIKE %s GROUP BY district",[gun])
-districts_gun_violent_crimes = cursor.fetchall()
+districts_gun_violent_crimes = list(report['gun_crimes_per_district'].items())
 districts_gun_violent_crimes_df = pd.DataFrame(districts_gun_violent_crimes, columns=['dist_num','gun_crimes'])
 districts_gun_violent_crimes_df['dist_num'] = districts_gun_violent_crimes_df['dist_num'].astype(str)
 districts_gun_violent_crimes_df
@@ -230,16 +246,8 @@ districts_gun_violent_crimes_df
 # In[15]:
 
 
-districts_gun_violent_crimes_map = folium.Map(location =(41.8781, -87.6298),zoom_start=11)
-districts_gun_violent_crimes_map.choropleth(geo_data="Boundaries.geojson", 
-              fill_color='YlOrRd', 
-              fill_opacity=0.5, 
-              line_opacity=1,
-              data = districts_gun_violent_crimes_df,
-              key_on='feature.properties.dist_num',
-              columns = ['dist_num', 'gun_crimes'],
-              legend_name="GUN CRIME"
-              )
+districts_gun_violent_crimes_map = map_rendering.MapSpec('districts_gun_violent_crimes')
+districts_gun_violent_crimes_map.choropleth(districts_gun_violent_crimes_df, ['dist_num', 'gun_crimes'], 'YlOrRd', "GUN CRIME")
 
 
 # Now, lets create a dataframe of the **different types of gun crimes for every district** and then plot it on Choropleth map
@@ -248,18 +256,12 @@ districts_gun_violent_crimes_map.choropleth(geo_data="Boundaries.geojson",
 
 
 
-cursor.execute("""SELECT ST_X(ST_AsText(Where_IS)), ST_Y(ST_AsText(Where_IS)), district from police_stations where district!='Headquarters'""")
-
-gun='%GUN%'
-police_stations = cursor.fetchall()
+gun_crimes_by_district = report['gun_crime_types']
 
 for police_station in police_stations:
     police_station_location = (police_station[0],police_station[1])
-    cursor.execute("""SELECT DESCRIPTION, count(DESCRIPTION) from crimes where district=%s and DESCRIPTION::text LIKE %s GROUP BY DESCRIPTION""",[police_station[2],gun])
-    district_gun_violent_crimes=cursor.fetchall()
-    district_gun_violent_crimes_df=pd.DataFrame(district_gun_violent_crimes, columns=['Description', 'Number of Gun Crime'])
-    header = district_gun_violent_crimes_df.to_html(classes='table table-striped table-hover table-condensed table-responsive')
-    folium.Marker(location=police_station_location,popup=folium.Popup(html="District No: %s GUN_Crime: %s" %(police_station[2],header) )).add_to(districts_gun_violent_crimes_map)
+    district_gun_violent_crimes=gun_crimes_by_district.get(crime_queries.district_key(police_station[2]), [])
+    districts_gun_violent_crimes_map.marker(police_station_location, map_rendering.table_popup("District No: %s GUN_Crime:" %police_station[2], district_gun_violent_crimes, ['Description', 'Number of Gun Crime']))
     
 
 
@@ -275,20 +277,8 @@ districts_gun_violent_crimes_map
 # In[18]:
 
 
-district=[]
-tarea=[]
-
-with open('Boundaries.geojson') as f:
-    data = json.load(f)
-    a = data['features']
-    for i in range(len(a)):
-        obj=a[i]['geometry']
-        n= a[i]['properties']
-        district.append(n['dist_num'])
-        tarea.append(area(obj)/10000)
-
-af=pd.DataFrame({'dist_num': district,'district_area_inHectares':tarea})
-af['dist_num'] = af['dist_num'].astype(str)
+profiler.enter('Query #4')
+af=district_boundaries.area_frame()
 final_data= pd.merge(af, crimes_per_district, on='dist_num', how='inner')
 final_data['crime_density'] = round(final_data['number_of_crimes']/(final_data['district_area_inHectares']/100))
 final_data
@@ -300,37 +290,16 @@ final_data
 # In[19]:
 
 
-gun_crime_arrests_map = folium.Map(location =(41.8781, -87.6298),zoom_start=11)
-gun_crime_arrests_map.choropleth(geo_data="Boundaries.geojson", 
-              fill_color='YlOrRd', 
-              fill_opacity=0.5, 
-              line_opacity=1,
-              data = districts_gun_violent_crimes_df,
-              key_on='feature.properties.dist_num',
-              columns = ['dist_num', 'gun_crimes'],
-              legend_name="GUN CRIME"
-              )
+profiler.enter('Query #5')
+gun_crime_arrests_map = map_rendering.MapSpec('gun_crime_arrests')
+gun_crime_arrests_map.choropleth(districts_gun_violent_crimes_df, ['dist_num', 'gun_crimes'], 'YlOrRd', "GUN CRIME")
 
 
 # In[20]:
 
 
-cursor.execute("""SELECT ST_X(ST_AsText(Where_IS)), ST_Y(ST_AsText(Where_IS)), district from police_stations where district!='Headquarters'""")
-gun='%GUN%'
-
-police_stations = cursor.fetchall()
-
-marker_cluster = MarkerCluster().add_to(gun_crime_arrests_map)
-
-for police_station in police_stations:
-    police_station_location = (police_station[0],police_station[1])
-    cursor.execute("""SELECT DISTINCT ON(caseno) caseno, block,DESCRIPTION, count(arrest), arrest,latitude, longitude from crimes where district=%s and DESCRIPTION::text LIKE %s GROUP BY caseno,block, DESCRIPTION,arrest, latitude, longitude""",[police_station[2],gun])
-    crimes_per_district = cursor.fetchall()
-    for crime in crimes_per_district:
-        if crime[4]==True:
-            folium.Marker(location=(crime[5],crime[6]),popup=folium.Popup(html="District No: %s <br> Description: %s <br> Block: %s" %(police_station[2],crime[2],crime[1])),icon=folium.Icon(color='green', icon='ok-sign'),).add_to(marker_cluster)
-        else:
-            folium.Marker(location=(crime[5],crime[6]),popup=folium.Popup(html="District No: %s <br> Description: %s<br> Block: %s" %(police_station[2],crime[2],crime[1])),icon=folium.Icon(color='red', icon='remove-sign'),).add_to(marker_cluster)
+# One layer per zoom level of the grid clusters computed on the database (one marker per grid cell and arrest value)
+gun_crime_arrests_map.clusters(report['gun_crime_arrest_clusters'], {True: 'green', False: 'red'}, 'Arrest')
 
             
 
@@ -347,39 +316,25 @@ gun_crime_arrests_map
 # In[22]:
 
 
-farthest_block_gun_crime_map = folium.Map(location =(41.8781, -87.6298),zoom_start=11)
-farthest_block_gun_crime_map.choropleth(geo_data="Boundaries.geojson", 
-              fill_color='YlOrRd', 
-              fill_opacity=0.5, 
-              line_opacity=1,
-              data = districts_gun_violent_crimes_df,
-              key_on='feature.properties.dist_num',
-              columns = ['dist_num', 'gun_crimes'],
-              legend_name="GUN CRIME"
-              )
+profiler.enter('Query #6')
+farthest_block_gun_crime_map = map_rendering.MapSpec('farthest_block_gun_crime')
+farthest_block_gun_crime_map.choropleth(districts_gun_violent_crimes_df, ['dist_num', 'gun_crimes'], 'YlOrRd', "GUN CRIME")
 
 
 # In[23]:
 
 
-cursor.execute("""SELECT ST_X(ST_AsText(Where_IS)), ST_Y(ST_AsText(Where_IS)), district from police_stations where district!='Headquarters'""")
-police_stations = cursor.fetchall()
-
-gun='%GUN%'
+farthest_gun_crimes = report['farthest_gun_crimes']
 
 for police_station in police_stations:
     
-    cursor.execute("""SELECT DISTINCT on (A.block) A.district,A.block, A.where_is,ST_Distance(A.where_is,B.where_is) from crimes as A, police_stations as B 
-    where ST_Distance(A.where_is,B.where_is) in ( SELECT max(dist) FROM 
-    (SELECT ST_Distance(A.where_is,B.where_is) as dist from crimes as A, police_stations as B where A.district=%s 
-    and DESCRIPTION::text LIKE %s and B.district= %s ) as f)""",[police_station[2],gun,police_station[2]])
-    
-    farthest_block_gun_crime = cursor.fetchall()
+    farthest_block_gun_crime = farthest_gun_crimes.get(crime_queries.district_key(police_station[2]))
+    if not farthest_block_gun_crime:
+        continue
 
-    cursor.execute("SELECT ST_X(ST_AsText(%s)), ST_Y(ST_AsText(%s))",(farthest_block_gun_crime[0][2],farthest_block_gun_crime[0][2]))
-    farthest_block_gun_crime_location = cursor.fetchall()
-    folium.Marker(location=(police_station[0],police_station[1]),popup=folium.Popup(html="Police Station <br> District No.:%s <br> Farthest Gun_Crime Block:%s"%(farthest_block_gun_crime[0][0],farthest_block_gun_crime[0][1]))).add_to(farthest_block_gun_crime_map)
-    folium.CircleMarker(farthest_block_gun_crime_location[0],radius=5,color='#ff3187',popup=folium.Popup(html="District No.:%s <br> Block:%s"%(farthest_block_gun_crime[0][0],farthest_block_gun_crime[0][1]))).add_to(farthest_block_gun_crime_map) 
+    block, x, y, distance = farthest_block_gun_crime[0]
+    farthest_block_gun_crime_map.marker((police_station[0],police_station[1]), "Police Station <br> District No.:%s <br> Farthest Gun_Crime Block:%s"%(police_station[2],block))
+    farthest_block_gun_crime_map.circle_marker((x,y), "District No.:%s <br> Block:%s"%(police_station[2],block))
 
 
 # In[24]:
@@ -401,35 +356,20 @@ farthest_block_gun_crime_map
 # In[25]:
 
 
-blocks_gun_crime_map = folium.Map(location =(41.8781, -87.6298),zoom_start=11)
-blocks_gun_crime_map.choropleth(geo_data="Boundaries.geojson", 
-              fill_color='YlOrRd', 
-              fill_opacity=0.5, 
-              line_opacity=1,
-              data = districts_gun_violent_crimes_df,
-              key_on='feature.properties.dist_num',
-              columns = ['dist_num', 'gun_crimes'],
-              legend_name="GUN CRIME"
-              )
+profiler.enter('Requirement #1')
+blocks_gun_crime_map = map_rendering.MapSpec('blocks_gun_crime')
+blocks_gun_crime_map.choropleth(districts_gun_violent_crimes_df, ['dist_num', 'gun_crimes'], 'YlOrRd', "GUN CRIME")
 
 
 # In[26]:
 
 
-cursor.execute("""SELECT ST_X(ST_AsText(Where_IS)), ST_Y(ST_AsText(Where_IS)), district from police_stations where district!='Headquarters'""")
-
-gun='%GUN%'
-police_stations = cursor.fetchall()
+top_gun_crime_blocks = report['top_gun_crime_blocks']
 
 for police_station in police_stations:
     police_station_location = (police_station[0],police_station[1])
-    cursor.execute("""SELECT BLOCK, count(BLOCK) from crimes where district=%s and DESCRIPTION::text LIKE %s GROUP BY BLOCK ORDER BY COUNT(BLOCK) DESC LIMIT 1""",[police_station[2],gun])
-    
-    block_gun_violent_crimes=cursor.fetchall()
-    
-    block_gun_violent_crimes_df=pd.DataFrame(block_gun_violent_crimes, columns=['Block', 'Number of Gun Crime'])
-    header = block_gun_violent_crimes_df.to_html(classes='table table-striped table-hover table-condensed table-responsive')
-    folium.Marker(location=police_station_location,popup=folium.Popup(html="District No: %s Block with Highest Gun Crimes: %s" %(police_station[2],header) )).add_to(blocks_gun_crime_map)
+    block_gun_violent_crimes=top_gun_crime_blocks.get(crime_queries.district_key(police_station[2]), [])
+    blocks_gun_crime_map.marker(police_station_location, map_rendering.table_popup("District No: %s Block with Highest Gun Crimes:" %police_station[2], block_gun_violent_crimes, ['Block', 'Number of Gun Crime']))
     
 
 
@@ -445,20 +385,8 @@ blocks_gun_crime_map
 # In[28]:
 
 
-district=[]
-tarea=[]
-
-with open('Boundaries.geojson') as f:
-    data = json.load(f)
-    a = data['features']
-    for i in range(len(a)):
-        obj=a[i]['geometry']
-        n= a[i]['properties']
-        district.append(n['dist_num'])
-        tarea.append(area(obj)/10000)
-
-ab=pd.DataFrame( {'dist_num': district, 'district_area_inHectares' :tarea})
-ab['dist_num'] = ab['dist_num'].astype(str)
+profiler.enter('Requirement #2')
+ab=district_boundaries.area_frame()
 
 finaldata = pd.merge (ab, districts_gun_violent_crimes_df, on= 'dist_num', how= 'inner')
 finaldata['gun_crime_density'] = round (finaldata['gun_crimes'] / (finaldata ['district_area_inHectares']/100))
@@ -477,8 +405,8 @@ finaldata
 # In[30]:
 
 
-cursor.execute("SELECT district, count(district) from crimes where DESCRIPTION = 'UNLAWFUL POSS OF HANDGUN' GROUP BY district")
-districts_upohg_crimes = cursor.fetchall()
+profiler.enter('Requirement #3')
+districts_upohg_crimes = list(report['upohg_crimes_per_district'].items())
 districts_upohg_crimes_df = pd.DataFrame(districts_upohg_crimes, columns=['dist_num','unlaw_pos_handgun_crimes'])
 districts_upohg_crimes_df ['dist_num'] = districts_upohg_crimes_df ['dist_num'].astype(str)
 districts_upohg_crimes_df
@@ -487,43 +415,26 @@ districts_upohg_crimes_df
 # In[31]:
 
 
-farthest_upohg_map = folium.Map(location =(41.8781, -87.6298),zoom_start=11)
-farthest_upohg_map.choropleth(geo_data="Boundaries.geojson", 
-              fill_color='YlOrRd', 
-              fill_opacity=0.5, 
-              line_opacity=1,
-              data = districts_upohg_crimes_df,
-              key_on='feature.properties.dist_num',
-              columns = ['dist_num', 'unlaw_pos_handgun_crimes'],
-              legend_name="UNLAWFUL POSESSION OF HANDGUN CRIME"
-              ) 
+farthest_upohg_map = map_rendering.MapSpec('farthest_upohg')
+farthest_upohg_map.choropleth(districts_upohg_crimes_df, ['dist_num', 'unlaw_pos_handgun_crimes'], 'YlOrRd', "UNLAWFUL POSESSION OF HANDGUN CRIME")
 
 
 # In[32]:
 
 
-cursor.execute("""SELECT ST_X(ST_AsText(Where_IS)), ST_Y(ST_AsText(Where_IS)), district from police_stations where district!='Headquarters'""")
-police_stations = cursor.fetchall()
-
-upohgc='UNLAWFUL POSS OF HANDGUN'
-
+farthest_upohg_crimes = report['farthest_upohg_crimes']
 
 
 for police_station in police_stations:
     
-    cursor.execute("""SELECT DISTINCT on (A.block) A.district,A.block, A.where_is,ST_Distance(A.where_is,B.where_is) from crimes as A, police_stations as B 
-    where ST_Distance(A.where_is,B.where_is) in ( SELECT max(dist) FROM 
-    (SELECT ST_Distance(A.where_is,B.where_is) as dist from crimes as A, police_stations as B where A.district=%s 
-    and DESCRIPTION::text LIKE %s and B.district= %s ) as f)""",[police_station[2],upohgc,police_station[2]])
-    
-    farthest_upohg_crime = cursor.fetchall()
+    farthest_upohg_crime = farthest_upohg_crimes.get(crime_queries.district_key(police_station[2]))
+    if not farthest_upohg_crime:
+        continue
 
-    cursor.execute("SELECT ST_X(ST_AsText(%s)), ST_Y(ST_AsText(%s))",(farthest_upohg_crime[0][2],farthest_upohg_crime[0][2]))
-    
-    farthest_upohg_crime_location = cursor.fetchall()
+    block, x, y, distance = farthest_upohg_crime[0]
     
-    folium.Marker(location=(police_station[0],police_station[1]),popup=folium.Popup(html="Police Station <br> District No.:%s <br> Farthest Unlawful Poss. of Handgun:%s"%(farthest_upohg_crime[0][0],farthest_upohg_crime[0][1]))).add_to(farthest_upohg_map)
-    folium.CircleMarker(farthest_upohg_crime_location[0],radius=5,color='#ff3187',popup=folium.Popup(html="District No.:%s <br> Block:%s"%(farthest_upohg_crime[0][0],farthest_upohg_crime[0][1]))).add_to(farthest_upohg_map) 
+    farthest_upohg_map.marker((police_station[0],police_station[1]), "Police Station <br> District No.:%s <br> Farthest Unlawful Poss. of Handgun:%s"%(police_station[2],block))
+    farthest_upohg_map.circle_marker((x,y), "District No.:%s <br> Block:%s"%(police_station[2],block))
   
 
 
@@ -540,37 +451,15 @@ farthest_upohg_map
 # In[34]:
 
 
-gun_crime_location_map = folium.Map(location =(41.8781, -87.6298),zoom_start=11)
-gun_crime_location_map.choropleth(geo_data="Boundaries.geojson", 
-              fill_color='YlOrRd', 
-              fill_opacity=0.5, 
-              line_opacity=1,
-              data = districts_gun_violent_crimes_df,
-              key_on='feature.properties.dist_num',
-              columns = ['dist_num', 'gun_crimes'],
-              legend_name="GUN CRIME"
-              )
+profiler.enter('Requirement #4')
+gun_crime_location_map = map_rendering.MapSpec('gun_crime_location')
+gun_crime_location_map.choropleth(districts_gun_violent_crimes_df, ['dist_num', 'gun_crimes'], 'YlOrRd', "GUN CRIME")
 
 
 # In[35]:
 
 
-cursor.execute("""SELECT ST_X(ST_AsText(Where_IS)), ST_Y(ST_AsText(Where_IS)), district from police_stations where district!='Headquarters'""")
-gun='%GUN%'
-
-police_stations = cursor.fetchall()
-
-marker_cluster = MarkerCluster().add_to(gun_crime_location_map)
-
-for police_station in police_stations:
-    police_station_location = (police_station[0],police_station[1])
-    cursor.execute("""SELECT DISTINCT ON(caseno) caseno, block, description, count (description), location_description, latitude, longitude from crimes where district=%s and DESCRIPTION::text LIKE %s and (location_description = 'RESIDENCE' or location_description = 'STREET') GROUP BY caseno,block, DESCRIPTION, location_description, latitude, longitude""",[police_station[2],gun])
-    crimes_per_area = cursor.fetchall()
-    for crime in crimes_per_area:
-        if crime[4]=='RESIDENCE':
-            folium.Marker(location=(crime[5],crime[6]),popup=folium.Popup(html="District No: %s <br> Description: %s <br> Block: %s" %(police_station[2],crime[2],crime[1])),icon=folium.Icon(color='green', icon='ok-sign'),).add_to(marker_cluster)
-        else:
-            folium.Marker(location=(crime[5],crime[6]),popup=folium.Popup(html="District No: %s <br> Description: %s<br> Block: %s" %(police_station[2],crime[2],crime[1])),icon=folium.Icon(color='red', icon='ok-sign'),).add_to(marker_cluster)
+gun_crime_location_map.clusters(report['gun_crime_location_clusters'], {'RESIDENCE': 'green', 'STREET': 'red'}, 'Location')
 
             
 
@@ -582,8 +471,134 @@ for police_station in police_stations:
 gun_crime_location_map
 
 
-# In[ ]:
+# ### Hotspots
+# 
+# - Where did the violent crimes of the past 4 weeks happen, compared to the 4 weeks before?
+# 
+# The districts are too coarse for this, so the crimes are also counted on a geohash grid (hotspot_grid, refreshed in In[2] together with the rollups): per cell of about 150 m, week, primary type and arrest. Coarser cells are prefixes of finer ones, so the map below uses 6 character cells (about 900 m x 600 m) without touching `crimes`.
+
+# In[37]:
+
+
+profiler.enter('Hotspots')
+violent_crime_trend = pd.DataFrame(report['violent_crime_trend'], columns=['cell', 'last_4_weeks', 'previous_4_weeks'])
+violent_crime_trend['change'] = violent_crime_trend['last_4_weeks'] - violent_crime_trend['previous_4_weeks']
+
+recent_cells = violent_crime_trend[violent_crime_trend['last_4_weeks'] > 0]
+violent_crime_hotspots_map = map_rendering.MapSpec('violent_crime_hotspots')
+violent_crime_hotspots_map.choropleth(recent_cells, ['cell', 'last_4_weeks'], 'YlOrRd', "VIOLENT CRIMES, LAST 4 WEEKS", key='cell',
+                                      geo_json=hotspot_grid.geo_json(dict(zip(recent_cells['cell'], recent_cells['last_4_weeks']))))
+
+# A marker on the 10 cells where violent crimes increased the most
+for cell, last_4_weeks, previous_4_weeks, change in violent_crime_trend.head(10).itertuples(index=False):
+    south, west, north, east = hotspot_grid.bounds(cell)
+    violent_crime_hotspots_map.marker(((south + north) / 2, (west + east) / 2), "Cell: %s <br> Last 4 weeks: %s <br> Previous 4 weeks: %s" % (cell, last_4_weeks, previous_4_weeks))
+
+violent_crime_trend.head(10)
+
+
+# In[38]:
+
+
+violent_crime_hotspots_map
+
+
+# ### Rendering
+# 
+# The map cells above only describe their maps (map_rendering.MapSpec): choropleth data, markers with their popup HTML and cluster layers. The folium maps are built from those descriptions and written to **MAP_DIRECTORY**, one HTML file per map, in a pool of processes, one map per core.
+
+# In[39]:
+
+
+profiler.enter('Rendering')
+map_paths = map_rendering.render_all([total_number_of_crimes_per_district_map, violent_crimes_per_district_map,
+                                      districts_gun_violent_crimes_map, gun_crime_arrests_map,
+                                      farthest_block_gun_crime_map, blocks_gun_crime_map,
+                                      farthest_upohg_map, gun_crime_location_map, violent_crime_hotspots_map], MAP_DIRECTORY)
+map_paths
+
+
+# ### Export mode
+# 
+# The folium maps above each embed the district boundaries and the HTML of every popup. With **EXPORT_DIRECTORY** set, the same eight maps are also written as small pages that share one simplified, quantized TopoJSON of the districts and only carry their own numbers per district and their markers, joined in the browser.
+
+# In[40]:
+
+
+profiler.enter('Export mode')
+def export_station_tables(exported, by_district, columns, title):
+    for police_station in police_stations:
+        rows = by_district.get(crime_queries.district_key(police_station[2]), [])
+        exported.marker((police_station[0], police_station[1]), [title % police_station[2]], rows=rows, columns=columns)
+
+
+def export_farthest(exported, farthest, title):
+    for police_station in police_stations:
+        crimes = farthest.get(crime_queries.district_key(police_station[2]))
+        if not crimes:
+            continue
+        block, x, y, distance = crimes[0]
+        exported.marker((police_station[0], police_station[1]),
+                        ['Police Station', 'District No.:%s' % police_station[2], '%s:%s' % (title, block)])
+        exported.marker((x, y), ['District No.:%s' % police_station[2], 'Block:%s' % block], color='#ff3187', radius=5)
+
+
+if EXPORT_DIRECTORY:
+    map_export.write_topology(district_boundaries, EXPORT_DIRECTORY, zoom=11)
+    exported_maps = []
+
+    exported = map_export.ExportedMap('total_number_of_crimes_per_district')
+    exported.choropleth(crimes_per_district, ['dist_num', 'number_of_crimes'], 'OrRd')
+    for police_station in police_stations:
+        district = crime_queries.district_key(police_station[2])
+        if district in districts_crime_numbers:
+            exported.marker((police_station[0], police_station[1]), ["District No : %s  has   Total Number of Crimes:%s" % (police_station[2], districts_crime_numbers[district])])
+    exported_maps.append(exported)
+
+    exported = map_export.ExportedMap('violent_crimes_per_district')
+    exported.choropleth(violent_crime_data, ['district_num', 'number_of_violent_crimes'], 'YlOrRd', "VOILENT CRIME MAP")
+    export_station_tables(exported, violent_crimes_by_district, ['Description', 'Number of Violent Crimes'], "District Number %s - Violent Crimes")
+    exported_maps.append(exported)
+
+    exported = map_export.ExportedMap('districts_gun_violent_crimes')
+    exported.choropleth(districts_gun_violent_crimes_df, ['dist_num', 'gun_crimes'], 'YlOrRd', "GUN CRIME")
+    export_station_tables(exported, gun_crimes_by_district, ['Description', 'Number of Gun Crime'], "District No: %s GUN_Crime:")
+    exported_maps.append(exported)
+
+    exported = map_export.ExportedMap('gun_crime_arrests')
+    exported.choropleth(districts_gun_violent_crimes_df, ['dist_num', 'gun_crimes'], 'YlOrRd', "GUN CRIME")
+    exported.grid_clusters(report['gun_crime_arrest_clusters'][0][1], {True: 'green', False: 'red'}, 'Arrest')
+    exported_maps.append(exported)
+
+    exported = map_export.ExportedMap('farthest_block_gun_crime')
+    exported.choropleth(districts_gun_violent_crimes_df, ['dist_num', 'gun_crimes'], 'YlOrRd', "GUN CRIME")
+    export_farthest(exported, farthest_gun_crimes, 'Farthest Gun_Crime Block')
+    exported_maps.append(exported)
+
+    exported = map_export.ExportedMap('blocks_gun_crime')
+    exported.choropleth(districts_gun_violent_crimes_df, ['dist_num', 'gun_crimes'], 'YlOrRd', "GUN CRIME")
+    export_station_tables(exported, top_gun_crime_blocks, ['Block', 'Number of Gun Crime'], "District No: %s Block with Highest Gun Crimes:")
+    exported_maps.append(exported)
+
+    exported = map_export.ExportedMap('farthest_upohg')
+    exported.choropleth(districts_upohg_crimes_df, ['dist_num', 'unlaw_pos_handgun_crimes'], 'YlOrRd', "UNLAWFUL POSESSION OF HANDGUN CRIME")
+    export_farthest(exported, farthest_upohg_crimes, 'Farthest Unlawful Poss. of Handgun')
+    exported_maps.append(exported)
+
+    exported = map_export.ExportedMap('gun_crime_location')
+    exported.choropleth(districts_gun_violent_crimes_df, ['dist_num', 'gun_crimes'], 'YlOrRd', "GUN CRIME")
+    exported.grid_clusters(report['gun_crime_location_clusters'][0][1], {'RESIDENCE': 'green', 'STREET': 'red'}, 'Location')
+    exported_maps.append(exported)
+
+    for exported in exported_maps:
+        exported.save(EXPORT_DIRECTORY)
+
 
+# In[41]:
 
 
+profiler.finish()
+profiler.write_json('report_profile.json')
+profiler.write_csv('report_profile.csv')
 
+pd.DataFrame(profiler.summary()).sort_values(by='wall_seconds', ascending=False)
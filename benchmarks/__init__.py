@@ -0,0 +1 @@
+"""Benchmarks of the crimes report on synthetic data; see run_report."""
@@ -0,0 +1,172 @@
+"""Time every section of the crimes report on synthetic data of growing size.
+
+For every scale the synthetic `crimes` and `police_stations` tables are
+loaded into a scratch PostGIS database, then `crime_report.prepare_database`
+and each query of `crime_report.queries()` run one at a time, so their
+latencies do not overlap. Each measurement records:
+
+- `seconds`: wall time of the section, database and Python;
+- `rows`: rows the section returned (summed over districts and layers);
+- `peak_python_mb`: peak memory allocated by Python during the section
+  (tracemalloc), i.e. what the rows cost on the client;
+- `max_rss_mb`: the peak resident size of the process so far.
+
+Tracing every allocation slows the Python side of a section down, so the
+memory of the queries is measured in a pass of its own, repetition 0, with no
+`seconds`; the timed repetitions run without tracemalloc and have no
+`peak_python_mb`.
+
+Rows are appended to a CSV, one per scale, section and repetition, with a
+`label` (e.g. the commit being measured), so scaling curves of two versions
+can be compared. A local PostGIS is enough, e.g.
+
+    docker run -d -p 5432:5432 -e POSTGRES_PASSWORD=bench postgis/postgis
+    python -m benchmarks.run_report --dsn "host=localhost user=postgres password=bench" --scales 1M 6.5M
+
+The report relies on PostgreSQL features (LATERAL, DISTINCT ON, pg_trgm,
+partitioned tables), so the database has to be PostgreSQL with PostGIS.
+Never point the DSN at a database with real data: the tables are replaced.
+"""
+
+import argparse
+import csv
+import datetime
+import os
+import resource
+import statistics
+import time
+import tracemalloc
+
+import psycopg2
+
+import crime_report
+from benchmarks import synthetic_crimes
+
+
+FIELDS = ['label', 'scale', 'crimes', 'section', 'repetition', 'seconds', 'rows', 'peak_python_mb', 'max_rss_mb',
+          'started']
+
+
+def result_rows(result):
+    """Number of rows in a report result: a list, a dict of lists or counts, or zoom layers."""
+    if isinstance(result, dict):
+        return sum(len(value) if isinstance(value, list) else 1 for value in result.values())
+    if isinstance(result, list):
+        if result and isinstance(result[0], tuple) and len(result[0]) == 2 and isinstance(result[0][1], list):
+            return sum(len(rows) for zoom, rows in result)
+        return len(result)
+    return 0 if result is None else 1
+
+
+def _max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024.0 * 1024.0) if os.uname()[0] == 'Darwin' else rss / 1024.0
+
+
+def measure(connection, query, trace=False):
+    """Run `query(cursor)` in its own transaction; returns (result, seconds, peak bytes).
+
+    With `trace`, allocations are traced for the peak, and the seconds,
+    inflated by the tracing, are None. Otherwise the peak is None.
+    """
+    if trace:
+        tracemalloc.start()
+    start = time.time()
+    cursor = connection.cursor()
+    try:
+        result = query(cursor)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+    seconds = time.time() - start
+    if not trace:
+        return result, seconds, None
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, None, peak
+
+
+def _mb(peak):
+    return None if peak is None else peak / 1e6
+
+
+def run_scale(connection, scale, rows, repetitions=1, seed=0, label='', now=synthetic_crimes.NOW):
+    """Load `rows` synthetic crimes dated up to `now` and time every report section; yields result rows."""
+    start = time.time()
+    synthetic_crimes.load(connection, rows, seed, now=now)
+    record = {'label': label, 'scale': scale, 'crimes': rows, 'started': datetime.datetime.now().isoformat()}
+    yield dict(record, section='load', repetition=0, seconds=time.time() - start, rows=rows,
+               peak_python_mb=None, max_rss_mb=_max_rss_mb())
+
+    # prepare_database only does its work once, so it is timed, not traced.
+    result, seconds, peak = measure(connection, crime_report.prepare_database)
+    yield dict(record, section='prepare_database', repetition=0, seconds=seconds, rows=result_rows(result),
+               peak_python_mb=None, max_rss_mb=_max_rss_mb())
+
+    for repetition in range(repetitions + 1):
+        for section, query in sorted(crime_report.queries().items()):
+            result, seconds, peak = measure(connection, query, trace=repetition == 0)
+            yield dict(record, section=section, repetition=repetition, seconds=seconds,
+                       rows=result_rows(result), peak_python_mb=_mb(peak), max_rss_mb=_max_rss_mb())
+
+
+def summary(records):
+    """Median seconds per section (rows) and scale (columns), as text."""
+    scales = []
+    seconds = {}
+    for record in records:
+        if record['scale'] not in scales:
+            scales.append(record['scale'])
+        if record['seconds'] in (None, ''):
+            continue
+        seconds.setdefault(record['section'], {}).setdefault(record['scale'], []).append(float(record['seconds']))
+    width = max(len(section) for section in seconds)
+    lines = ['%-*s %s' % (width, 'section', ' '.join('%10s' % scale for scale in scales))]
+    for section, by_scale in seconds.items():
+        lines.append('%-*s %s' % (width, section, ' '.join(
+            '%10.2f' % statistics.median(by_scale[scale]) if scale in by_scale else '%10s' % '-' for scale in scales)))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--dsn', required=True, help='libpq connection string of a scratch PostGIS database')
+    parser.add_argument('--scales', nargs='+', default=['1M', '6.5M', '20M'],
+                        help='row counts, by name (%s) or as numbers' % ', '.join(synthetic_crimes.SCALES))
+    parser.add_argument('--repetitions', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--now', type=lambda value: datetime.datetime.strptime(value, '%Y-%m-%d'),
+                        default=synthetic_crimes.NOW, help='date of the latest synthetic crimes, YYYY-MM-DD')
+    parser.add_argument('--label', default='', help='stored with every row, e.g. the commit being measured')
+    parser.add_argument('--output', default=os.path.join('benchmarks', 'results.csv'))
+    args = parser.parse_args(argv)
+
+    connection = psycopg2.connect(args.dsn)
+    records = []
+    new_file = not os.path.exists(args.output)
+    try:
+        with open(args.output, 'a') as f:
+            writer = csv.DictWriter(f, FIELDS)
+            if new_file:
+                writer.writeheader()
+            for scale in args.scales:
+                rows = synthetic_crimes.SCALES.get(scale) or int(float(scale))
+                for record in run_scale(connection, scale, rows, args.repetitions, args.seed, args.label, args.now):
+                    writer.writerow(record)
+                    f.flush()
+                    records.append(record)
+                    if record['seconds'] is None:
+                        print('%(scale)8s %(section)-28s %(peak_python_mb)8.1fMB %(rows)9d rows' % record)
+                    else:
+                        print('%(scale)8s %(section)-28s %(seconds)9.2fs %(rows)9d rows' % record)
+    finally:
+        connection.close()
+    print(summary(records))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+"""Synthetic `crimes` and `police_stations` tables shaped like the Chicago data.
+
+The report can only be timed against the real 6.5M row table on the
+university server. `load` writes a table of any size with the columns the
+report reads and distributions close to the real ones:
+
+- 22 districts, with crimes spread around their police station and more
+  crimes in the busier districts;
+- primary types and descriptions, with their arrest rates, from the most
+  frequent offenses, including the gun crimes the report looks for;
+- location descriptions, blocks named after the Chicago street grid (so
+  nearby crimes share a block) and dates spread over `years` up to `now`.
+
+As in the real tables, `where_is` is POINT(latitude longitude). The same
+`seed`, `chunksize` and `now` (by default the fixed NOW, not the clock)
+always give the same rows.
+"""
+
+import datetime
+import io
+
+import numpy as np
+import pandas as pd
+
+
+SCALES = {'1M': 1000000, '6.5M': 6500000, '20M': 20000000}
+CHUNKSIZE = 500000
+YEARS = 18
+NOW = datetime.datetime(2019, 1, 1)
+
+# district, name, station latitude and longitude, share of the crimes
+DISTRICTS = [
+    (1, 'Central', 41.8584, -87.6274, 4.0), (2, 'Wentworth', 41.8018, -87.6237, 4.5),
+    (3, 'Grand Crossing', 41.7665, -87.6057, 5.0), (4, 'South Chicago', 41.7079, -87.5683, 5.5),
+    (5, 'Calumet', 41.6921, -87.6047, 4.5), (6, 'Gresham', 41.7523, -87.6442, 6.0),
+    (7, 'Englewood', 41.7797, -87.6605, 5.5), (8, 'Chicago Lawn', 41.7787, -87.7089, 6.5),
+    (9, 'Deering', 41.8374, -87.6465, 4.5), (10, 'Ogden', 41.8565, -87.7084, 4.5),
+    (11, 'Harrison', 41.8735, -87.7053, 6.5), (12, 'Near West', 41.8580, -87.6571, 4.5),
+    (14, 'Shakespeare', 41.9212, -87.6974, 3.5), (15, 'Austin', 41.8800, -87.7682, 4.0),
+    (16, 'Jefferson Park', 41.9742, -87.7664, 3.0), (17, 'Albany Park', 41.9665, -87.7283, 2.5),
+    (18, 'Near North', 41.9036, -87.6434, 4.5), (19, 'Town Hall', 41.9474, -87.6514, 4.0),
+    (20, 'Lincoln', 41.9799, -87.6928, 1.8), (22, 'Morgan Park', 41.6915, -87.6685, 3.0),
+    (24, 'Rogers Park', 41.9997, -87.6713, 2.7), (25, 'Grand Central', 41.9182, -87.7655, 5.0),
+]
+HEADQUARTERS = ('Headquarters', 'Headquarters', 41.8304, -87.6232)
+SPREAD = (0.018, 0.022)
+
+# primary type, description, share of the crimes, arrest rate
+OFFENSES = [
+    ('THEFT', '$500 AND UNDER', 12.0, 0.10), ('THEFT', 'OVER $500', 5.0, 0.05),
+    ('THEFT', 'RETAIL THEFT', 4.0, 0.45), ('THEFT', 'FROM BUILDING', 3.0, 0.05),
+    ('BATTERY', 'SIMPLE', 10.0, 0.20), ('BATTERY', 'DOMESTIC BATTERY SIMPLE', 8.0, 0.25),
+    ('BATTERY', 'AGGRAVATED: HANDGUN', 0.5, 0.12), ('BATTERY', 'AGGRAVATED: OTHER DANG WEAPON', 0.5, 0.25),
+    ('CRIMINAL DAMAGE', 'TO VEHICLE', 5.0, 0.03), ('CRIMINAL DAMAGE', 'TO PROPERTY', 5.0, 0.07),
+    ('NARCOTICS', 'POSS: CANNABIS 30GMS OR LESS', 4.0, 0.99), ('NARCOTICS', 'POSS: HEROIN(WHITE)', 2.0, 0.99),
+    ('ASSAULT', 'SIMPLE', 4.0, 0.18), ('ASSAULT', 'AGGRAVATED: HANDGUN', 0.8, 0.15),
+    ('ASSAULT', 'AGGRAVATED: OTHER DANG WEAPON', 0.5, 0.25),
+    ('OTHER OFFENSE', 'TELEPHONE THREAT', 2.0, 0.05), ('OTHER OFFENSE', 'HARASSMENT BY TELEPHONE', 2.0, 0.05),
+    ('BURGLARY', 'FORCIBLE ENTRY', 4.0, 0.05), ('BURGLARY', 'UNLAWFUL ENTRY', 1.5, 0.07),
+    ('MOTOR VEHICLE THEFT', 'AUTOMOBILE', 4.0, 0.07),
+    ('DECEPTIVE PRACTICE', 'FINANCIAL IDENTITY THEFT OVER $ 300', 1.5, 0.02),
+    ('DECEPTIVE PRACTICE', 'CREDIT CARD FRAUD', 1.0, 0.08),
+    ('ROBBERY', 'ARMED: HANDGUN', 1.5, 0.10), ('ROBBERY', 'STRONGARM - NO WEAPON', 1.2, 0.10),
+    ('WEAPONS VIOLATION', 'UNLAWFUL POSS OF HANDGUN', 0.8, 0.80),
+    ('WEAPONS VIOLATION', 'UNLAWFUL USE HANDGUN', 0.2, 0.60),
+    ('WEAPONS VIOLATION', 'RECKLESS FIREARM DISCHARGE', 0.2, 0.10),
+    ('CRIMINAL TRESPASS', 'TO LAND', 1.0, 0.70), ('PROSTITUTION', 'SOLICIT FOR BUSINESS', 0.3, 0.99),
+    ('KIDNAPPING', 'CHILD ABDUCTION/STRANGER', 0.03, 0.10), ('CRIM SEXUAL ASSAULT', 'NON-AGGRAVATED', 0.2, 0.15),
+    ('HOMICIDE', 'FIRST DEGREE MURDER', 0.08, 0.40),
+]
+
+LOCATIONS = [
+    ('STREET', 22.0), ('RESIDENCE', 17.0), ('APARTMENT', 12.0), ('SIDEWALK', 9.0), ('OTHER', 4.0),
+    ('PARKING LOT/GARAGE(NON.RESID.)', 3.0), ('ALLEY', 2.0), ('SMALL RETAIL STORE', 2.0), ('RESTAURANT', 2.0),
+    ('SCHOOL, PUBLIC, BUILDING', 2.0), ('RESIDENCE-GARAGE', 2.0), ('VEHICLE NON-COMMERCIAL', 2.0),
+    ('GROCERY FOOD STORE', 1.0), ('DEPARTMENT STORE', 1.0), ('CTA PLATFORM', 0.5), ('GAS STATION', 1.0),
+]
+
+# The street grid: 800 numbers per mile from State and Madison.
+ORIGIN = (41.8819, -87.6278)
+MILE = (0.01449, 0.01932)
+NORTH_SOUTH_STREETS = ['STATE ST', 'DEARBORN ST', 'CLARK ST', 'LASALLE ST', 'WELLS ST', 'HALSTED ST',
+                       'RACINE AVE', 'ASHLAND AVE', 'DAMEN AVE', 'WESTERN AVE', 'CALIFORNIA AVE',
+                       'KEDZIE AVE', 'PULASKI RD', 'CICERO AVE', 'LARAMIE AVE', 'CENTRAL AVE',
+                       'AUSTIN AVE', 'HARLEM AVE', 'COTTAGE GROVE AVE', 'STONY ISLAND AVE']
+EAST_WEST_STREETS = ['MADISON ST', 'ROOSEVELT RD', 'CERMAK RD', '31ST ST', '35TH ST', '47TH ST', '55TH ST',
+                     '63RD ST', '71ST ST', '79TH ST', '87TH ST', '95TH ST', 'CHICAGO AVE', 'DIVISION ST',
+                     'NORTH AVE', 'ARMITAGE AVE', 'FULLERTON AVE', 'BELMONT AVE', 'IRVING PARK RD',
+                     'LAWRENCE AVE', 'FOSTER AVE', 'DEVON AVE']
+
+# Tables that crime_rollups and hotspot_grid derive from `crimes`.
+DERIVED_TABLES = ('recent_crimes', 'crime_rollup', 'crime_block_rollup', 'crime_hotspot_grid', 'rollup_watermarks')
+
+CRIME_COLUMNS = ['id', 'caseno', 'date', 'block', 'primary_type', 'description', 'location_description',
+                 'arrest', 'domestic', 'beat', 'district', 'latitude', 'longitude', 'where_is']
+
+CREATE_CRIMES = """CREATE TABLE crimes (
+id bigint PRIMARY KEY,
+caseno text NOT NULL,
+date timestamp NOT NULL,
+block text,
+primary_type text,
+description text,
+location_description text,
+arrest boolean,
+domestic boolean,
+beat integer,
+district integer,
+latitude double precision,
+longitude double precision,
+where_is geometry(Point))"""
+
+CREATE_POLICE_STATIONS = """CREATE TABLE police_stations (
+district text PRIMARY KEY,
+district_name text NOT NULL,
+latitude double precision NOT NULL,
+longitude double precision NOT NULL,
+where_is geometry(Point) NOT NULL)"""
+
+
+def _shares(weights):
+    weights = np.asarray(weights, dtype=np.float64)
+    return weights / weights.sum()
+
+
+def _blocks(rng, latitude, longitude):
+    """A block on the street grid near every point, e.g. '063XX S HALSTED ST'."""
+    north = (latitude - ORIGIN[0]) / MILE[0] * 800
+    east = (longitude - ORIGIN[1]) / MILE[1] * 800
+    on_north_south = rng.random(len(latitude)) < 0.5
+    numbers = np.where(on_north_south, np.abs(north), np.abs(east)).astype(np.int64) // 100
+    directions = np.where(on_north_south, np.where(north >= 0, 'N', 'S'), np.where(east >= 0, 'E', 'W'))
+    # Half a mile per street, so the crimes of a neighbourhood share a few streets.
+    north_south = np.take(NORTH_SOUTH_STREETS, (np.abs(east) // 400).astype(np.int64), mode='wrap')
+    east_west = np.take(EAST_WEST_STREETS, (np.abs(north) // 400).astype(np.int64), mode='wrap')
+    streets = np.where(on_north_south, north_south, east_west)
+    return pd.Series(numbers).map('{:03d}XX'.format).str.cat([directions, streets], sep=' ')
+
+
+def generate(rows, start_id=0, seed=0, years=YEARS, now=NOW):
+    """A DataFrame of `rows` synthetic crimes with ids from `start_id`, dated
+    over the `years` before `now`."""
+    rng = np.random.default_rng([seed, start_id])
+
+    district = rng.choice(len(DISTRICTS), rows, p=_shares([d[4] for d in DISTRICTS]))
+    centers = np.array([d[2:4] for d in DISTRICTS])[district]
+    latitude = np.round(centers[:, 0] + rng.normal(0, SPREAD[0], rows), 9)
+    longitude = np.round(centers[:, 1] + rng.normal(0, SPREAD[1], rows), 9)
+
+    offense = rng.choice(len(OFFENSES), rows, p=_shares([o[2] for o in OFFENSES]))
+    location = rng.choice(len(LOCATIONS), rows, p=_shares([l[1] for l in LOCATIONS]))
+    arrest = rng.random(rows) < np.array([o[3] for o in OFFENSES])[offense]
+    seconds = rng.integers(0, int(years * 365.25 * 86400), rows)
+
+    ids = np.arange(start_id, start_id + rows)
+    frame = pd.DataFrame({
+        'id': ids,
+        'caseno': pd.Series(ids).map('JB{:08d}'.format),
+        'date': pd.Timestamp(now) - pd.to_timedelta(seconds, unit='s'),
+        'block': _blocks(rng, latitude, longitude),
+        'primary_type': np.take([o[0] for o in OFFENSES], offense),
+        'description': np.take([o[1] for o in OFFENSES], offense),
+        'location_description': np.take([l[0] for l in LOCATIONS], location),
+        'arrest': arrest,
+        'domestic': rng.random(rows) < 0.15,
+        'district': np.array([d[0] for d in DISTRICTS])[district],
+        'latitude': latitude,
+        'longitude': longitude,
+    })
+    frame['beat'] = frame['district'] * 100 + rng.integers(1, 16, rows)
+    frame['where_is'] = 'POINT(' + frame['latitude'].astype(str) + ' ' + frame['longitude'].astype(str) + ')'
+    return frame[CRIME_COLUMNS]
+
+
+def police_stations():
+    """The police stations of the districts, and Headquarters."""
+    rows = [(str(d[0]), d[1], d[2], d[3]) for d in DISTRICTS] + [HEADQUARTERS]
+    frame = pd.DataFrame(rows, columns=['district', 'district_name', 'latitude', 'longitude'])
+    frame['where_is'] = 'POINT(' + frame['latitude'].astype(str) + ' ' + frame['longitude'].astype(str) + ')'
+    return frame
+
+
+def _copy(cursor, frame, table):
+    buffer = io.StringIO()
+    frame.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    cursor.copy_expert('COPY %s (%s) FROM STDIN WITH (FORMAT csv)' % (table, ', '.join(frame.columns)), buffer)
+
+
+def load(connection, rows, seed=0, years=YEARS, chunksize=CHUNKSIZE, drop=DERIVED_TABLES, now=NOW):
+    """Replace `crimes` and `police_stations` with `rows` synthetic crimes.
+
+    The tables in `drop` (by default the ones derived from `crimes`) are
+    dropped too, so the report starts from scratch. Only one chunk of
+    `chunksize` crimes is held in memory at a time.
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS postgis')
+        for table in drop + ('crimes', 'police_stations'):
+            cursor.execute('DROP TABLE IF EXISTS %s CASCADE' % table)
+        cursor.execute(CREATE_CRIMES)
+        cursor.execute(CREATE_POLICE_STATIONS)
+        _copy(cursor, police_stations(), 'police_stations')
+        for start in range(0, rows, chunksize):
+            _copy(cursor, generate(min(chunksize, rows - start), start, seed, years, now), 'crimes')
+        cursor.execute('ANALYZE crimes')
+        cursor.execute('ANALYZE police_stations')
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
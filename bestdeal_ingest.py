@@ -0,0 +1,122 @@
+"""Bulk load of BestDeal transaction files (DirtyData4BestDeal10000.csv).
+
+The notebook used to parse the CSV with the regex separator ' *, *', which
+only the pure-Python parser supports, and then wrote it with `to_sql`, one
+INSERT per row, leaving ZipCode and CustomerAge as FLOAT columns. Here:
+
+- the fast C parser reads the file in chunks; `skipinitialspace` and its
+  numeric conversion take care of the blanks around the commas;
+- every chunk is cleaned with vectorized masks (the same rules as the
+  notebook: no missing values, CustomerAge 16..80, ZipCode <= 99999, product
+  flags <= 1) and converted to compact integer types;
+- the rows go to an explicitly typed table in one transaction, with
+  `executemany` (SQLite) or `COPY` (PostgreSQL).
+
+SQLite stores the integers 0 and 1 in the record header alone, so INTEGER
+product flags take no more space than a packed bit column would.
+"""
+
+import io
+
+import numpy as np
+import pandas as pd
+
+
+CHUNKSIZE = 100000
+TABLE = 'trans4cust'
+
+PRODUCTS = ['SamsungTV46LED', 'SonyTV42LED', 'XBOX360', 'DellLaptop', 'BoseSoundSystem', 'BoseHeadSet',
+            'SonyHeadSet', 'iPod', 'iPhone', 'Panasonic50LED', 'SonyPS4', 'WiiU', 'WDexternalHD',
+            'SamsungTV55LED', 'SonyTV60LED', 'SandiskMemoryCard', 'SonySoundSystem', 'SonyCamera',
+            'PanasonicCamera', 'HPPrinter', 'SonyDVDplayer', 'ToshibaDVDplayer', 'GalaxyTablet',
+            'SurfaceTablet', 'HPLaptop', 'HDMICable', 'SpeakerCable', 'CallOfDutyGame', 'GrandTheftAutoGame',
+            'ASUSLaptop', 'LenevoLaptop', 'TVStandWallMount']
+COLUMNS = ['ZipCode', 'CustomerAge'] + PRODUCTS
+
+MIN_AGE = 16
+MAX_AGE = 80
+MAX_ZIP = 99999
+
+
+def read_chunks(path, chunksize=CHUNKSIZE):
+    """Yield the raw rows of `path` as DataFrames of at most `chunksize` rows.
+
+    The index keeps counting across chunks, like the row numbers of a single
+    `read_csv`.
+    """
+    reader = pd.read_csv(path, skipinitialspace=True, engine='c', chunksize=chunksize)
+    for chunk in reader:
+        chunk.columns = [column.strip() for column in chunk.columns]
+        yield chunk
+
+
+def clean(chunk):
+    """The valid rows of `chunk`, with ZipCode and CustomerAge as int32 and
+    the product flags as int8."""
+    chunk = chunk[COLUMNS].apply(pd.to_numeric, errors='coerce').dropna()
+    valid = ((chunk['CustomerAge'] >= MIN_AGE) & (chunk['CustomerAge'] <= MAX_AGE)
+             & (chunk['ZipCode'] <= MAX_ZIP)
+             & (chunk[PRODUCTS] <= 1).all(axis=1))
+    chunk = chunk[valid]
+    return chunk.astype(dict([('ZipCode', np.int32), ('CustomerAge', np.int32)]
+                             + [(product, np.int8) for product in PRODUCTS]))
+
+
+def read_clean(path, chunksize=CHUNKSIZE):
+    """Yield the cleaned chunks of `path`."""
+    for chunk in read_chunks(path, chunksize):
+        yield clean(chunk)
+
+
+def create_table_sql(table=TABLE):
+    columns = ['"index" INTEGER NOT NULL'] + ['"%s" INTEGER NOT NULL' % column for column in COLUMNS]
+    return 'CREATE TABLE IF NOT EXISTS %s (\n    %s\n)' % (table, ',\n    '.join(columns))
+
+
+def _copy(cursor, chunk, table):
+    buffer = io.StringIO()
+    chunk.to_csv(buffer, header=False)
+    buffer.seek(0)
+    columns = ', '.join('"%s"' % column for column in ['index'] + COLUMNS)
+    cursor.copy_expert('COPY %s (%s) FROM STDIN WITH (FORMAT csv)' % (table, columns), buffer)
+
+
+def _insert(cursor, chunk, table, placeholder):
+    query = 'INSERT INTO %s VALUES (%s)' % (table, ', '.join([placeholder] * (len(COLUMNS) + 1)))
+    cursor.executemany(query, chunk.reset_index().to_numpy().tolist())
+
+
+def load(chunks, engine, table=TABLE, replace=True):
+    """Bulk load cleaned `chunks` into `table` through `engine`.
+
+    The whole load is one transaction: either every row is stored or, on
+    error, the table is left as it was. Returns the number of rows loaded.
+    """
+    postgres = engine.dialect.name == 'postgresql'
+    placeholder = '?' if engine.dialect.paramstyle == 'qmark' else '%s'
+    connection = engine.raw_connection()
+    loaded = 0
+    try:
+        cursor = connection.cursor()
+        if replace:
+            cursor.execute('DROP TABLE IF EXISTS %s' % table)
+        cursor.execute(create_table_sql(table))
+        for chunk in chunks:
+            if postgres:
+                _copy(cursor, chunk, table)
+            else:
+                _insert(cursor, chunk, table, placeholder)
+            loaded += len(chunk)
+        cursor.execute('CREATE INDEX IF NOT EXISTS ix_%s_index ON %s ("index")' % (table, table))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+    return loaded
+
+
+def ingest(path, engine, table=TABLE, chunksize=CHUNKSIZE, replace=True):
+    """Read, clean and load `path` chunk by chunk, in bounded memory."""
+    return load(read_clean(path, chunksize), engine, table, replace)
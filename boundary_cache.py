@@ -0,0 +1,183 @@
+"""Parsed, measured and simplified district boundaries.
+
+Query #4 and Requirement #2 used to `json.load` Boundaries.geojson and run
+`area()` over every district polygon, and every choropleth re-read the file
+and embedded it at full resolution. `load` parses the file once, computes
+the area of every district and keeps a simplified copy of the geometry per
+zoom level. The result is kept in memory and pickled next to the GeoJSON
+file (`Boundaries.geojson.cache`); the pickle is reused as long as the file
+has the same mtime and size, or the same SHA-1 if it was only touched.
+"""
+
+import copy
+import hashlib
+import json
+import os
+import pickle
+
+import pandas as pd
+from area import area
+
+
+ZOOM_LEVELS = (10, 11, 12, 13, 14)
+CACHE_SUFFIX = '.cache'
+CACHE_VERSION = 1
+
+_loaded = {}
+
+
+def pixel_size(zoom):
+    """Width of one 256px web-map tile pixel in degrees at `zoom`."""
+    return 360.0 / (256 * 2 ** zoom)
+
+
+def simplify_line(points, tolerance):
+    """Douglas-Peucker simplification of a line of [x, y] points.
+
+    Both end points are always kept, so a line may come down to 2 points.
+    """
+    if len(points) <= 2:
+        return points
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        x1, y1 = points[first][0], points[first][1]
+        x2, y2 = points[last][0], points[last][1]
+        dx, dy = x2 - x1, y2 - y1
+        length = (dx * dx + dy * dy) ** 0.5
+        farthest, index = 0.0, None
+        for i in range(first + 1, last):
+            x, y = points[i][0], points[i][1]
+            if length:
+                distance = abs(dy * x - dx * y + x2 * y1 - y2 * x1) / length
+            else:
+                distance = ((x - x1) ** 2 + (y - y1) ** 2) ** 0.5
+            if distance > farthest:
+                farthest, index = distance, i
+        if index is not None and farthest > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def simplify_ring(ring, tolerance):
+    """Douglas-Peucker simplification of a closed ring of [x, y] points.
+
+    A ring that would lose its area (fewer than 4 points) is kept as is.
+    """
+    if len(ring) <= 4:
+        return ring
+    simplified = simplify_line(ring, tolerance)
+    if len(simplified) < 4:
+        return ring
+    return simplified
+
+
+def simplify_geometry(geometry, tolerance):
+    """Simplify every ring of a Polygon or MultiPolygon geometry."""
+    if geometry['type'] == 'Polygon':
+        coordinates = [simplify_ring(ring, tolerance) for ring in geometry['coordinates']]
+    elif geometry['type'] == 'MultiPolygon':
+        coordinates = [[simplify_ring(ring, tolerance) for ring in polygon] for polygon in geometry['coordinates']]
+    else:
+        return geometry
+    return {'type': geometry['type'], 'coordinates': coordinates}
+
+
+class Boundaries(object):
+    """The features of a boundary file, their areas and simplified copies."""
+
+    def __init__(self, features, key='dist_num', zoom_levels=ZOOM_LEVELS):
+        self.key = key
+        self.features = features
+        self.areas = {}
+        for feature in features:
+            self.areas[str(feature['properties'][key])] = area(feature['geometry']) / 10000
+        self.simplified = {}
+        for zoom in zoom_levels:
+            tolerance = pixel_size(zoom)
+            self.simplified[zoom] = [
+                {'type': 'Feature',
+                 'properties': feature['properties'],
+                 'geometry': simplify_geometry(feature['geometry'], tolerance)}
+                for feature in features]
+
+    def area_frame(self):
+        """DataFrame of dist_num and district_area_inHectares."""
+        return pd.DataFrame({'dist_num': list(self.areas.keys()),
+                             'district_area_inHectares': list(self.areas.values())})
+
+    def geo_json(self, zoom=None):
+        """A GeoJSON FeatureCollection, simplified for `zoom` if given.
+
+        Falls back to the closest cached zoom level at or above `zoom`, so
+        the boundaries never look coarser than a pixel.
+        """
+        features = self.features
+        if zoom is not None and self.simplified:
+            levels = sorted(level for level in self.simplified if level >= zoom) or [max(self.simplified)]
+            features = self.simplified[levels[0]]
+        # folium annotates the features it is given, so hand out a copy.
+        return {'type': 'FeatureCollection', 'features': copy.deepcopy(features)}
+
+
+def _sha1(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _read_cache(cache_path):
+    try:
+        with open(cache_path, 'rb') as f:
+            cached = pickle.load(f)
+    except (IOError, OSError, EOFError, pickle.UnpicklingError):
+        return None
+    if cached.get('version') != CACHE_VERSION:
+        return None
+    return cached
+
+
+def _write_cache(cache_path, cached):
+    try:
+        with open(cache_path, 'wb') as f:
+            pickle.dump(cached, f, pickle.HIGHEST_PROTOCOL)
+    except (IOError, OSError):
+        pass
+
+
+def load(path='Boundaries.geojson', key='dist_num'):
+    """Boundaries for `path`, from memory, the on-disk cache or a fresh parse."""
+    stat = os.stat(path)
+    signature = (stat.st_mtime, stat.st_size)
+    memory_key = (os.path.abspath(path), key)
+    if memory_key in _loaded and _loaded[memory_key][0] == signature:
+        return _loaded[memory_key][1]
+
+    cache_path = path + CACHE_SUFFIX
+    cached = _read_cache(cache_path)
+    boundaries = None
+    if cached is not None and cached['key'] == key:
+        if cached['signature'] == signature:
+            boundaries = cached['boundaries']
+        else:
+            sha1 = _sha1(path)
+            if cached['sha1'] == sha1:
+                boundaries = cached['boundaries']
+                cached['signature'] = signature
+                _write_cache(cache_path, cached)
+
+    if boundaries is None:
+        with open(path) as f:
+            features = json.load(f)['features']
+        boundaries = Boundaries(features, key)
+        _write_cache(cache_path, {'version': CACHE_VERSION, 'key': key, 'signature': signature,
+                                  'sha1': _sha1(path), 'boundaries': boundaries})
+
+    _loaded[memory_key] = (signature, boundaries)
+    return boundaries
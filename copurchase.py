@@ -0,0 +1,169 @@
+"""Precomputed co-purchase counts of the BestDeal products.
+
+The BestDeal questions are co-purchase counts (Dell laptop and HP printer,
+HP laptop without WD external HD, ...), each of them one more SQL query.
+CoPurchase keeps, for the 32 products:
+
+- the pair matrix `X.T @ X` of the 0/1 flag matrix X: the diagonal holds the
+  buyers of each product, cell (i, j) the buyers of both i and j;
+- the triple counts, one matrix product per product;
+- the pair matrix per CustomerAge and per ZipCode.
+
+Counts of up to three products, with or without other products, are then
+lookups, and `append` adds a new cleaned batch to every count:
+
+    co = CoPurchase.from_sql(engine)
+    co.count(['DellLaptop', 'HPPrinter'])
+    co.count(['HPLaptop'], without=['WDexternalHD'], CustomerAge=35)
+
+`frequent_itemsets` mines itemsets of any size with Apriori, counting the
+support of every candidate on the bitsets of a ProductBasket.
+"""
+
+import itertools
+
+import numpy as np
+import pandas as pd
+
+import bestdeal_ingest
+import product_basket
+
+
+SLICES = ['CustomerAge', 'ZipCode']
+
+
+def _pairs(flags):
+    # Floating point products go through BLAS and are exact far beyond any row count here.
+    return np.rint(flags.T.dot(flags)).astype(np.int64)
+
+
+def _triples(flags):
+    return np.array([_pairs(flags * flags[:, [i]]) for i in range(flags.shape[1])])
+
+
+class CoPurchase(object):
+    """Pair and triple co-purchase counts, updated batch by batch."""
+
+    def __init__(self, products=bestdeal_ingest.PRODUCTS, slices=SLICES):
+        self.products = list(products)
+        self.positions = dict((product, i) for i, product in enumerate(self.products))
+        size = len(self.products)
+        self.transactions = 0
+        self.pairs = np.zeros((size, size), dtype=np.int64)
+        self.triples = np.zeros((size, size, size), dtype=np.int64)
+        self.sliced = dict((dimension, {}) for dimension in slices)
+        self.slice_sizes = dict((dimension, {}) for dimension in slices)
+
+    @classmethod
+    def from_frame(cls, frame, products=bestdeal_ingest.PRODUCTS, slices=SLICES):
+        co = cls(products, slices)
+        co.append(frame)
+        return co
+
+    @classmethod
+    def from_sql(cls, engine, table=bestdeal_ingest.TABLE, products=bestdeal_ingest.PRODUCTS, slices=SLICES,
+                 chunksize=product_basket.CHUNKSIZE):
+        co = cls(products, slices)
+        columns = ', '.join(list(slices) + list(products))
+        for chunk in pd.read_sql_query('SELECT %s FROM %s' % (columns, table), engine, chunksize=chunksize):
+            co.append(chunk)
+        return co
+
+    def append(self, frame):
+        """Add the transactions of a cleaned batch to every count."""
+        flags = (frame[self.products].to_numpy() == 1).astype(np.float64)
+        self.transactions += len(frame)
+        self.pairs += _pairs(flags)
+        self.triples += _triples(flags)
+        for dimension, matrices in self.sliced.items():
+            sizes = self.slice_sizes[dimension]
+            for value, rows in frame.groupby(dimension).indices.items():
+                pairs = _pairs(flags[rows])
+                if value in matrices:
+                    matrices[value] += pairs
+                else:
+                    matrices[value] = pairs
+                sizes[value] = sizes.get(value, 0) + len(rows)
+
+    def _slice(self, slices):
+        if len(slices) > 1:
+            raise ValueError('Counts are sliced by one of %s at a time' % ', '.join(self.sliced))
+        (dimension, value), = slices.items()
+        return dimension, value
+
+    def _pairs_of(self, slices):
+        if not slices:
+            return self.pairs
+        dimension, value = self._slice(slices)
+        return self.sliced[dimension].get(value, np.zeros_like(self.pairs))
+
+    def _size_of(self, slices):
+        if not slices:
+            return self.transactions
+        dimension, value = self._slice(slices)
+        return self.slice_sizes[dimension].get(value, 0)
+
+    def _count(self, products, slices):
+        index = sorted(self.positions[product] for product in products)
+        if len(index) == 0:
+            return self._size_of(slices)
+        if len(index) == 1:
+            return int(self._pairs_of(slices)[index[0], index[0]])
+        if len(index) == 2:
+            return int(self._pairs_of(slices)[index[0], index[1]])
+        if len(index) == 3 and not slices:
+            return int(self.triples[index[0], index[1], index[2]])
+        raise ValueError('Only counts of up to %s products are precomputed' % (2 if slices else 3))
+
+    def count(self, products, without=(), **slices):
+        """Transactions that bought all of `products` and none of `without`.
+
+        At most three products in all (two within a CustomerAge or ZipCode
+        slice); the `without` products are subtracted by inclusion-exclusion.
+        """
+        products = list(products)
+        total = 0
+        for size in range(len(without) + 1):
+            for excluded in itertools.combinations(without, size):
+                total += (-1) ** size * self._count(products + list(excluded), slices)
+        return total
+
+    def pairs_frame(self, **slices):
+        """The pair matrix as a DataFrame labelled by product."""
+        return pd.DataFrame(self._pairs_of(slices), index=self.products, columns=self.products)
+
+
+def frequent_itemsets(basket, min_support=0.1, max_size=None):
+    """Itemsets bought together in at least `min_support` of the transactions.
+
+    Apriori: the candidates of size k + 1 are the unions of frequent k-sets
+    whose k-subsets are all frequent, and the support of a candidate is the
+    popcount of the AND of its product bitsets.
+    """
+    min_count = min_support * basket.size
+    level = {}
+    for product in basket.products:
+        selection = basket[product]
+        if len(selection) >= min_count:
+            level[(product,)] = selection
+    found = []
+    size = 1
+    while level:
+        found.extend((itemset, len(selection)) for itemset, selection in level.items())
+        if size == max_size:
+            break
+        frequent = set(level)
+        candidates = {}
+        for first, second in itertools.combinations(sorted(level), 2):
+            if first[:-1] != second[:-1]:
+                continue
+            itemset = first + second[-1:]
+            if all(subset in frequent for subset in itertools.combinations(itemset, size)):
+                selection = level[first] & basket[second[-1]]
+                if len(selection) >= min_count:
+                    candidates[itemset] = selection
+        level = candidates
+        size += 1
+    result = pd.DataFrame(found, columns=['itemset', 'count'])
+    result['support'] = result['count'] / float(basket.size)
+    return result.sort_values(by='count', ascending=False).reset_index(drop=True)
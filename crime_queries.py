@@ -0,0 +1,197 @@
+"""Set-based queries for the Chicago crimes report.
+
+Every map in Geospatial_SQL_Queries_Analysis_Visualizations.py used to fetch
+the police stations and then run one query per station against `crimes`.
+The helpers below issue one grouped query per map instead and fan the rows
+out to the stations in memory, keyed on the district number.
+
+A predicate is a `(sql, params)` pair that is pasted into the WHERE clause,
+so the same query can be reused for violent crimes, gun crimes, etc.
+
+Set STRICT_PLANS to make `run` EXPLAIN every statement first and raise
+SeqScanError instead of running one that would sequentially scan `crimes`.
+Set CACHE to a query_cache.QueryCache to reuse results of unchanged data.
+Set PROFILER to a query_profiler.Profiler to time every executed statement.
+"""
+
+import collections
+import json
+
+import top_k
+
+
+POLICE_STATIONS = """SELECT ST_X(ST_AsText(Where_IS)), ST_Y(ST_AsText(Where_IS)), district from police_stations where district!='Headquarters'"""
+
+ALL_CRIMES = ('TRUE', ())
+
+STRICT_PLANS = False
+CACHE = None
+PROFILER = None
+GUARDED_TABLES = ('crimes',)
+
+
+class SeqScanError(Exception):
+    """Raised when a statement would sequentially scan a guarded table."""
+
+
+def description_like(pattern):
+    """Predicate for crimes whose DESCRIPTION matches a LIKE pattern.
+
+    DESCRIPTION is compared without a `::text` cast so that the pg_trgm
+    index from `ensure_trigram_index` can serve leading-wildcard patterns.
+    """
+    return ('DESCRIPTION LIKE %s', (pattern,))
+
+
+def description_is(description):
+    """Predicate for crimes with exactly this DESCRIPTION."""
+    return ('DESCRIPTION = %s', (description,))
+
+
+def primary_type_in(categories):
+    """Predicate for crimes whose PRIMARY_TYPE is one of `categories`."""
+    return ('PRIMARY_TYPE in %s', (tuple(categories),))
+
+
+GUN_CRIMES = description_like('%GUN%')
+
+
+def both(*predicates):
+    """AND several predicates together."""
+    sql = ' AND '.join('(%s)' % predicate[0] for predicate in predicates)
+    params = ()
+    for predicate in predicates:
+        params += tuple(predicate[1])
+    return (sql, params)
+
+
+def district_key(district):
+    """Normalise a district number so that 7, 7.0, '7' and '007' match."""
+    try:
+        return str(int(float(district)))
+    except (TypeError, ValueError):
+        return str(district)
+
+
+def _plan_nodes(plan):
+    yield plan
+    for child in plan.get('Plans', []):
+        for node in _plan_nodes(child):
+            yield node
+
+
+def check_plan(cursor, query, params=None, tables=GUARDED_TABLES):
+    """Raise SeqScanError if `query` would sequentially scan one of `tables`."""
+    cursor.execute('EXPLAIN (FORMAT JSON) ' + query, params)
+    plan = cursor.fetchone()[0]
+    if not isinstance(plan, list):
+        plan = json.loads(plan)
+    for node in _plan_nodes(plan[0]['Plan']):
+        if node['Node Type'] == 'Seq Scan' and node.get('Relation Name') in tables:
+            raise SeqScanError('Sequential scan on %s for query: %s' % (node['Relation Name'], query))
+
+
+def _execute(cursor, query, params):
+    if STRICT_PLANS:
+        check_plan(cursor, query, params)
+    if PROFILER is not None:
+        return PROFILER.execute(cursor, query, params)
+    cursor.execute(query, params)
+    return cursor.fetchall()
+
+
+def run(cursor, query, params=None):
+    """Execute `query` and return all of its rows, through CACHE if set."""
+    if CACHE is not None:
+        return CACHE.fetch(cursor, query, params, _execute)
+    return _execute(cursor, query, params)
+
+
+def fetch_police_stations(cursor):
+    """Return (x, y, district) for every police station but Headquarters."""
+    return run(cursor, POLICE_STATIONS)
+
+
+def group_by_district(rows):
+    """Group rows whose first column is the district, dropping that column."""
+    grouped = collections.defaultdict(list)
+    for row in rows:
+        grouped[district_key(row[0])].append(tuple(row[1:]))
+    return grouped
+
+
+def district_counts(cursor, predicate=ALL_CRIMES, table='crimes'):
+    """Number of crimes matching `predicate` per district, in one query."""
+    query = "SELECT district, count(district) from %s where %s GROUP BY district" % (table, predicate[0])
+    return dict((district_key(district), count) for district, count in run(cursor, query, predicate[1]))
+
+
+def counts_by_district(cursor, column, predicate=ALL_CRIMES, table='crimes'):
+    """(value, count) pairs of `column` per district, in one query.
+
+    Replaces the per-station `SELECT column, count(column) ... where
+    district=%s GROUP BY column` loops.
+    """
+    query = "SELECT district, %s, count(%s) from %s where %s GROUP BY district, %s ORDER BY district, %s" % (
+        column, column, table, predicate[0], column, column)
+    return group_by_district(run(cursor, query, predicate[1]))
+
+
+def top_blocks_per_district(cursor, predicate=ALL_CRIMES, k=1, table='crimes'):
+    """(block, count) of the `k` blocks with the most crimes in every district, most first."""
+    query = "SELECT district, BLOCK as block, count(BLOCK) as crimes from %s where %s GROUP BY district, BLOCK" % (
+        table, predicate[0])
+    query = top_k.ranked_query(query, 'crimes DESC, block', 'district', ['district', 'block', 'crimes'])
+    rows = run(cursor, query, tuple(predicate[1]) + (k,))
+    return group_by_district((district, block, count) for district, block, count, rank in rows)
+
+
+def top_block_per_district(cursor, predicate=ALL_CRIMES, table='crimes'):
+    """(block, count) of the block with the most crimes in every district."""
+    return top_blocks_per_district(cursor, predicate, 1, table)
+
+
+def crimes_by_district(cursor, columns, predicate=ALL_CRIMES, table='crimes'):
+    """One row per case with the requested `columns`, grouped per district."""
+    query = "SELECT DISTINCT ON (caseno) district, %s from %s where %s ORDER BY caseno" % (
+        ', '.join(columns), table, predicate[0])
+    return group_by_district(run(cursor, query, predicate[1]))
+
+
+def ensure_spatial_indexes(cursor):
+    """Create the indexes used by `crimes_from_station` if they are missing."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS crimes_where_is_gist ON crimes USING GIST (where_is)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS police_stations_where_is_gist ON police_stations USING GIST (where_is)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS crimes_district_idx ON crimes (district)")
+
+
+def ensure_trigram_index(cursor, table='crimes'):
+    """Create the pg_trgm GIN index that serves `description_like` patterns,
+    and the B-tree index that serves `description_is`."""
+    cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    cursor.execute("CREATE INDEX IF NOT EXISTS %s_description_trgm ON %s USING GIN (description gin_trgm_ops)" % (table, table))
+    cursor.execute("CREATE INDEX IF NOT EXISTS %s_description_idx ON %s (description)" % (table, table))
+
+
+def crimes_from_station(cursor, predicate=ALL_CRIMES, n=1, farthest=True, table='crimes'):
+    """The `n` crimes farthest from (or nearest to) each district's police station.
+
+    Runs one LATERAL query over the stations instead of cross joining
+    `crimes` with `police_stations`, and returns the crime coordinates with
+    the rows, so no follow-up `ST_X(ST_AsText(...))` round trip is needed.
+    Rows are (block, x, y, distance), grouped per district with the
+    farthest (or nearest) crime first. Nearest-first ordering uses the KNN
+    `<->` operator so it is served by the GiST index on `where_is`.
+    """
+    if farthest:
+        order = 'ST_Distance(A.where_is, B.where_is) DESC'
+    else:
+        order = 'A.where_is <-> B.where_is'
+    # Only numbered stations are joined, and the cast cannot fail on
+    # 'Headquarters' wherever the planner evaluates it.
+    query = """SELECT B.district, A.block, ST_X(A.where_is), ST_Y(A.where_is), ST_Distance(A.where_is, B.where_is)
+    from (SELECT district, CASE WHEN district ~ '^[0-9]+$' THEN district::integer END as district_id, where_is
+    from police_stations where district ~ '^[0-9]+$') as B CROSS JOIN LATERAL
+    (SELECT block, where_is from %s as A where A.district = B.district_id and %s ORDER BY %s LIMIT %%s) as A
+    ORDER BY B.district, %s""" % (table, predicate[0], order, order)
+    return group_by_district(run(cursor, query, tuple(predicate[1]) + (n,)))
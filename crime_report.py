@@ -0,0 +1,50 @@
+"""The queries of the Chicago crimes report, by section.
+
+Geospatial_SQL_Queries_Analysis_Visualizations.py runs them concurrently and
+builds its maps from the results; benchmarks/run_report.py runs the same
+queries, one at a time, against synthetic data. Each entry of `queries()`
+is a function of a cursor, as report_runner expects.
+"""
+
+import crime_queries
+import crime_rollups
+import hotspot_grid
+import marker_clusters
+
+
+VIOLENT_CRIME_CATEGORIES = ('THEFT', 'ASSAULT', 'ROBBERY', 'KIDNAPPING', 'CRIM SEXUAL ASSAULT', 'BATTERY', 'MURDER')
+UPOHGC = 'UNLAWFUL POSS OF HANDGUN'
+RESIDENCE_OR_STREET = ("location_description in ('RESIDENCE', 'STREET')", ())
+
+
+def prepare_database(cursor):
+    """Create the indexes the report relies on and refresh the rollups and the hotspot grid."""
+    crime_queries.ensure_spatial_indexes(cursor)
+    crime_queries.ensure_trigram_index(cursor)
+    crime_rollups.refresh(cursor)
+    hotspot_grid.refresh(cursor)
+
+
+def queries():
+    """`name -> query(cursor)` for every section of the report."""
+    violent = crime_queries.primary_type_in(VIOLENT_CRIME_CATEGORIES)
+    guns = crime_queries.GUN_CRIMES
+    return {
+        'police_stations': crime_queries.fetch_police_stations,
+        'crimes_per_district': lambda cursor: crime_rollups.district_counts(cursor),
+        'violent_crimes_per_district': lambda cursor: crime_rollups.district_counts(cursor, violent),
+        'violent_crime_types': lambda cursor: crime_rollups.counts_by_district(cursor, 'PRIMARY_TYPE', violent),
+        'gun_crimes_per_district': lambda cursor: crime_rollups.district_counts(cursor, guns),
+        'gun_crime_types': lambda cursor: crime_rollups.counts_by_district(cursor, 'DESCRIPTION', guns),
+        'gun_crime_arrest_clusters': lambda cursor: marker_clusters.cluster_layers(
+            cursor, 'arrest', guns, crime_rollups.RECENT_CRIMES),
+        'farthest_gun_crimes': lambda cursor: crime_queries.crimes_from_station(cursor, guns),
+        'top_gun_crime_blocks': lambda cursor: crime_rollups.top_block_per_district(cursor, guns),
+        'upohg_crimes_per_district': lambda cursor: crime_queries.district_counts(
+            cursor, crime_queries.description_is(UPOHGC)),
+        'farthest_upohg_crimes': lambda cursor: crime_queries.crimes_from_station(
+            cursor, crime_queries.description_is(UPOHGC)),
+        'gun_crime_location_clusters': lambda cursor: marker_clusters.cluster_layers(
+            cursor, 'location_description', crime_queries.both(guns, RESIDENCE_OR_STREET), crime_rollups.RECENT_CRIMES),
+        'violent_crime_trend': lambda cursor: hotspot_grid.trend(cursor, 4, 6, violent),
+    }
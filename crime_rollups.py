@@ -0,0 +1,199 @@
+"""Materialized slice of recent crimes and the rollups the report reads.
+
+The report only looks at the past two years, but used to scan the whole
+6.5M row `crimes` table for every query. `refresh` keeps three tables up to
+date instead:
+
+- `recent_crimes`: a copy of the crimes of the last WINDOW_YEARS before the
+  latest crime, range partitioned by year and indexed on (district, date).
+  The report reads every district at once, so district goes in the index
+  rather than in sub-partitions, which would only multiply the tables.
+- `crime_rollup`: crime counts per district, primary_type, description,
+  arrest and location_description.
+- `crime_block_rollup`: crime counts per district, description and block.
+
+The watermark in `rollup_watermarks` holds the largest crime `id` appended
+and the start of the window. Each refresh appends the crimes with a larger
+`id`, so crimes reported late, with an older date, are still picked up, and
+it costs O(new crimes). When the latest crime moves the window forward, the
+crimes that fall out of it are subtracted from the rollups and their year
+partitions dropped. A window started at a fixed `since` (see `rebuild`)
+keeps that start, stored with the watermark, and never expires.
+
+The query helpers mirror the ones in crime_queries and return the same
+shapes, so a map cell can switch between them without other changes.
+"""
+
+import datetime
+
+import crime_queries
+import top_k
+
+
+RECENT_CRIMES = 'recent_crimes'
+CRIME_ROLLUP = 'crime_rollup'
+BLOCK_ROLLUP = 'crime_block_rollup'
+
+WINDOW_YEARS = 2
+
+
+def create_tables(cursor):
+    """Create the slice, rollup and watermark tables if they are missing."""
+    cursor.execute("""CREATE TABLE IF NOT EXISTS rollup_watermarks (
+    name text PRIMARY KEY,
+    last_date timestamp NOT NULL,
+    last_id bigint,
+    since timestamp)""")
+    cursor.execute("""CREATE TABLE IF NOT EXISTS %s (LIKE crimes INCLUDING DEFAULTS)
+    PARTITION BY RANGE (date)""" % RECENT_CRIMES)
+    cursor.execute("CREATE INDEX IF NOT EXISTS %s_district_date_idx ON %s (district, date)" % (RECENT_CRIMES, RECENT_CRIMES))
+    cursor.execute("CREATE INDEX IF NOT EXISTS crimes_date_idx ON crimes (date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS crimes_id_idx ON crimes (id)")
+    crime_queries.ensure_trigram_index(cursor, RECENT_CRIMES)
+    cursor.execute("""CREATE TABLE IF NOT EXISTS %s (
+    district integer NOT NULL,
+    primary_type text NOT NULL,
+    description text NOT NULL,
+    arrest boolean NOT NULL,
+    location_description text NOT NULL,
+    crimes bigint NOT NULL,
+    PRIMARY KEY (district, primary_type, description, arrest, location_description))""" % CRIME_ROLLUP)
+    cursor.execute("""CREATE TABLE IF NOT EXISTS %s (
+    district integer NOT NULL,
+    description text NOT NULL,
+    block text NOT NULL,
+    crimes bigint NOT NULL,
+    PRIMARY KEY (district, description, block))""" % BLOCK_ROLLUP)
+
+
+def _create_year_partitions(cursor, first_year, last_year):
+    for year in range(first_year, last_year + 1):
+        cursor.execute("""CREATE TABLE IF NOT EXISTS %s_%d PARTITION OF %s
+        FOR VALUES FROM ('%d-01-01') TO ('%d-01-01')""" % (RECENT_CRIMES, year, RECENT_CRIMES, year, year + 1))
+
+
+def _drop_year_partitions(cursor, first_year, last_year):
+    for year in range(first_year, last_year + 1):
+        cursor.execute("DROP TABLE IF EXISTS %s_%d" % (RECENT_CRIMES, year))
+
+
+def _watermark(cursor):
+    """(window start, last id, fixed start) of the slice, or Nones before the first refresh."""
+    cursor.execute("SELECT last_date, last_id, since from rollup_watermarks where name = %s", [RECENT_CRIMES])
+    row = cursor.fetchone()
+    return tuple(row) if row else (None, None, None)
+
+
+def _expire(cursor, old_start, start):
+    """Subtract the crimes dated before `start` from the rollups and drop them from the slice."""
+    cursor.execute("""UPDATE %s as R SET crimes = R.crimes - E.crimes FROM (
+    SELECT district, coalesce(primary_type, '') as primary_type, coalesce(description, '') as description,
+    coalesce(arrest, false) as arrest, coalesce(location_description, '') as location_description, count(*) as crimes
+    from %s where date < %%s and district IS NOT NULL
+    GROUP BY 1, 2, 3, 4, 5) as E
+    WHERE R.district = E.district and R.primary_type = E.primary_type and R.description = E.description
+    and R.arrest = E.arrest and R.location_description = E.location_description""" % (CRIME_ROLLUP, RECENT_CRIMES),
+                   [start])
+    cursor.execute("""UPDATE %s as R SET crimes = R.crimes - E.crimes FROM (
+    SELECT district, coalesce(description, '') as description, coalesce(block, '') as block, count(*) as crimes
+    from %s where date < %%s and district IS NOT NULL
+    GROUP BY 1, 2, 3) as E
+    WHERE R.district = E.district and R.description = E.description and R.block = E.block""" % (
+        BLOCK_ROLLUP, RECENT_CRIMES), [start])
+    cursor.execute("DELETE from %s where crimes <= 0" % CRIME_ROLLUP)
+    cursor.execute("DELETE from %s where crimes <= 0" % BLOCK_ROLLUP)
+    # Whole years go with their partition, the rest of the oldest year row by row.
+    _drop_year_partitions(cursor, old_start.year, start.year - 1)
+    cursor.execute("DELETE from %s where date < %%s" % RECENT_CRIMES, [start])
+
+
+def refresh(cursor, since=None):
+    """Append the crimes added since the last refresh to the slice and the
+    rollups, and expire the crimes that fell out of the window.
+
+    The window covers the WINDOW_YEARS before the latest crime in `crimes`.
+    A `since` given on the first run (or to `rebuild`) fixes the start of
+    the window instead, for this and every later refresh; on later runs the
+    argument is ignored. Returns the number of crimes appended. The caller
+    owns the transaction and should commit afterwards.
+    """
+    create_tables(cursor)
+    old_start, last_id, fixed_start = _watermark(cursor)
+    if old_start is None:
+        fixed_start = since
+
+    cursor.execute("SELECT max(id), max(date) from crimes")
+    max_id, max_date = cursor.fetchone()
+    if max_id is None:
+        return 0
+    start = fixed_start or max_date - datetime.timedelta(days=365 * WINDOW_YEARS)
+    if old_start is not None:
+        if start > old_start:
+            _expire(cursor, old_start, start)
+        else:
+            start = old_start
+
+    appended = 0
+    if last_id is None or max_id > last_id:
+        _create_year_partitions(cursor, start.year, max_date.year)
+        cursor.execute("""WITH added AS (
+        INSERT INTO %s SELECT * from crimes where id > %%s and id <= %%s and date >= %%s RETURNING *),
+        rollup AS (INSERT INTO %s
+        SELECT district, coalesce(primary_type, ''), coalesce(description, ''), coalesce(arrest, false),
+        coalesce(location_description, ''), count(*)
+        from added where district IS NOT NULL
+        GROUP BY 1, 2, 3, 4, 5
+        ON CONFLICT (district, primary_type, description, arrest, location_description)
+        DO UPDATE SET crimes = %s.crimes + EXCLUDED.crimes),
+        block_rollup AS (INSERT INTO %s
+        SELECT district, coalesce(description, ''), coalesce(block, ''), count(*)
+        from added where district IS NOT NULL
+        GROUP BY 1, 2, 3
+        ON CONFLICT (district, description, block)
+        DO UPDATE SET crimes = %s.crimes + EXCLUDED.crimes)
+        SELECT count(*) from added""" % (RECENT_CRIMES, CRIME_ROLLUP, CRIME_ROLLUP, BLOCK_ROLLUP, BLOCK_ROLLUP),
+                       [-1 if last_id is None else last_id, max_id, start])
+        appended = int(cursor.fetchone()[0])
+
+    cursor.execute("""INSERT INTO rollup_watermarks VALUES (%s, %s, %s, %s)
+    ON CONFLICT (name) DO UPDATE SET last_date = EXCLUDED.last_date, last_id = EXCLUDED.last_id""",
+                   [RECENT_CRIMES, start, max_id, fixed_start])
+    return appended
+
+
+def rebuild(cursor, since=None):
+    """Drop everything and refresh from scratch, e.g. to fix the start of the
+    window at `since`, or with `since=None` to go back to a rolling window."""
+    create_tables(cursor)
+    cursor.execute("DROP TABLE %s, %s, %s" % (RECENT_CRIMES, CRIME_ROLLUP, BLOCK_ROLLUP))
+    cursor.execute("DELETE from rollup_watermarks where name = %s", [RECENT_CRIMES])
+    return refresh(cursor, since)
+
+
+def district_counts(cursor, predicate=crime_queries.ALL_CRIMES):
+    """Rollup version of crime_queries.district_counts."""
+    query = "SELECT district, sum(crimes) from %s where %s GROUP BY district" % (CRIME_ROLLUP, predicate[0])
+    rows = crime_queries.run(cursor, query, predicate[1])
+    return dict((crime_queries.district_key(district), int(count)) for district, count in rows)
+
+
+def counts_by_district(cursor, column, predicate=crime_queries.ALL_CRIMES):
+    """Rollup version of crime_queries.counts_by_district."""
+    query = "SELECT district, %s, sum(crimes) from %s where %s GROUP BY district, %s ORDER BY district, %s" % (
+        column, CRIME_ROLLUP, predicate[0], column, column)
+    rows = crime_queries.run(cursor, query, predicate[1])
+    return crime_queries.group_by_district((district, value, int(count)) for district, value, count in rows)
+
+
+def top_blocks_per_district(cursor, predicate=crime_queries.ALL_CRIMES, k=1):
+    """Rollup version of crime_queries.top_blocks_per_district."""
+    query = "SELECT district, block, sum(crimes) as crimes from %s where %s GROUP BY district, block" % (
+        BLOCK_ROLLUP, predicate[0])
+    query = top_k.ranked_query(query, 'crimes DESC, block', 'district', ['district', 'block', 'crimes'])
+    rows = crime_queries.run(cursor, query, tuple(predicate[1]) + (k,))
+    return crime_queries.group_by_district((district, block, int(count)) for district, block, count, rank in rows)
+
+
+def top_block_per_district(cursor, predicate=crime_queries.ALL_CRIMES):
+    """Rollup version of crime_queries.top_block_per_district."""
+    return top_blocks_per_district(cursor, predicate, 1)
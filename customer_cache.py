@@ -0,0 +1,79 @@
+"""Columnar, memory-mapped cache of the XYZ customer file (xyzcust10.csv).
+
+The notebook used to parse the CSV, pickle the DataFrame, unpickle it again
+and take two deep copies of it just to drop the duplicated ZIP9 column in
+two different ways: three copies of the data before any analysis. Here the
+CSV is parsed once, with the multi-threaded Arrow reader, into an
+uncompressed Feather (Arrow IPC) file next to it (`xyzcust10.csv.feather`).
+`load` memory-maps that file and reads only the columns asked for, so:
+
+- a column that is dropped is never read, instead of being copied and
+  deleted;
+- numeric columns without missing values are handed to pandas without a
+  copy, straight from the page cache, and every frame loaded from the same
+  file shares them. Those columns are read-only; `load(..., writable=True)`
+  copies them for code that edits the frame in place.
+
+The cache is rebuilt whenever the CSV has a different mtime or size.
+"""
+
+import os
+
+import pyarrow as pa
+from pyarrow import csv, feather
+
+
+CACHE_SUFFIX = '.feather'
+CACHE_VERSION = b'1'
+
+
+def cache_path(path):
+    return path + CACHE_SUFFIX
+
+
+def _signature(path):
+    stat = os.stat(path)
+    return ('%r:%d' % (stat.st_mtime, stat.st_size)).encode('utf-8')
+
+
+def _is_fresh(path, cached):
+    try:
+        metadata = feather.read_table(cached, columns=[], memory_map=True).schema.metadata or {}
+    except (IOError, OSError, pa.ArrowInvalid):
+        return False
+    return metadata.get(b'version') == CACHE_VERSION and metadata.get(b'signature') == _signature(path)
+
+
+def build(path):
+    """Parse the CSV at `path` into its Feather cache and return the cache path."""
+    # One record batch, so that every column maps to one contiguous buffer.
+    table = csv.read_csv(path).combine_chunks()
+    table = table.replace_schema_metadata({b'version': CACHE_VERSION, b'signature': _signature(path)})
+    cached = cache_path(path)
+    feather.write_feather(table, cached + '.tmp', compression='uncompressed',
+                          chunksize=max(table.num_rows, 1))
+    os.rename(cached + '.tmp', cached)
+    return cached
+
+
+def read_table(path='xyzcust10.csv', columns=None, exclude=()):
+    """The memory-mapped Arrow table of `path`, restricted to `columns` minus `exclude`."""
+    cached = cache_path(path)
+    if not _is_fresh(path, cached):
+        build(path)
+    if columns is None:
+        columns = feather.read_table(cached, columns=[], memory_map=True).schema.names
+    columns = [column for column in columns if column not in exclude]
+    return feather.read_table(cached, columns=columns, memory_map=True)
+
+
+def load(path='xyzcust10.csv', columns=None, exclude=(), writable=False):
+    """`path` as a DataFrame, through the columnar cache.
+
+    Only `columns` (default: all) minus `exclude` are read. Blocks are not
+    consolidated, so numeric columns stay views of the memory map, which is
+    read-only: assigning into them in place raises a ValueError. Pass
+    `writable=True` to get a frame that owns a copy of its data.
+    """
+    frame = read_table(path, columns, exclude).to_pandas(split_blocks=True)
+    return frame.copy() if writable else frame
@@ -0,0 +1,157 @@
+"""Incremental, hash-based load of XYZ customer batches into xyzcust.
+
+The notebook deduplicated the whole customer frame with `drop_duplicates()`
+and rewrote the whole table with `to_sql('xyzcust', engine)`, so a new batch
+meant reprocessing every customer. Here the database keeps, next to
+xyzcust, an index of one 64 bit digest per account (`xyzcust_digests`,
+ACCTNO -> digest of the customer row). A batch is streamed through in
+chunks; for every chunk:
+
+- repeated rows and accounts within the chunk are dropped (the last row of
+  an account wins);
+- the row digests are matched against the index with one join on its
+  primary key;
+- only new accounts are inserted and only changed accounts replaced.
+
+The work per load is proportional to the size of the batch, not of the
+table. The SQL is SQLite's, like xyz.db. A table written by `to_sql` has no
+digest index yet: the first upsert builds it from the rows already in the
+table (`index_table`), once.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+TABLE = 'xyzcust'
+KEY = 'ACCTNO'
+CHUNKSIZE = 50000
+
+
+def digests_table(table=TABLE):
+    return table + '_digests'
+
+
+def row_digests(frame):
+    """A signed 64 bit digest per row of `frame`.
+
+    Numbers are hashed as floats, so a column parsed as integers in one batch
+    and as floats in another still gets the same digests.
+    """
+    canonical = frame.apply(lambda column: column.astype(np.float64)
+                            if pd.api.types.is_numeric_dtype(column) else column.astype(object))
+    return pd.util.hash_pandas_object(canonical, index=False).to_numpy().view(np.int64)
+
+
+def _sql_type(column):
+    if pd.api.types.is_integer_dtype(column) or pd.api.types.is_bool_dtype(column):
+        return 'INTEGER'
+    if pd.api.types.is_float_dtype(column):
+        return 'REAL'
+    return 'TEXT'
+
+
+def create_tables(cursor, frame, table=TABLE, key=KEY):
+    """Create `table` with the columns of `frame`, and its digest index."""
+    columns = ', '.join('"%s" %s' % (name, _sql_type(frame[name])) for name in frame.columns)
+    cursor.execute('CREATE TABLE IF NOT EXISTS %s (%s)' % (table, columns))
+    cursor.execute('CREATE INDEX IF NOT EXISTS ix_%s_%s ON %s ("%s")' % (table, key, table, key))
+    cursor.execute('CREATE TABLE IF NOT EXISTS %s ("%s" TEXT PRIMARY KEY, digest INTEGER NOT NULL)'
+                   % (digests_table(table), key))
+
+
+def index_table(cursor, frame, table=TABLE, key=KEY, chunksize=CHUNKSIZE):
+    """Fill an empty digest index from the rows already in `table`.
+
+    The rows are digested over the columns of `frame` (e.g. leaving out the
+    index column of `to_sql`), with their dtypes, so they match the digests
+    of the same rows in a batch. The last row of an account wins. Returns
+    the number of rows read.
+    """
+    cursor.execute('SELECT count(*) FROM %s' % digests_table(table))
+    if cursor.fetchone()[0]:
+        return 0
+    columns = ', '.join('"%s"' % name for name in frame.columns)
+    cursor.execute('SELECT %s FROM %s ORDER BY rowid' % (columns, table))
+    read = 0
+    while True:
+        rows = cursor.fetchmany(chunksize)
+        if not rows:
+            return read
+        read += len(rows)
+        stored = pd.DataFrame.from_records(rows, columns=frame.columns).astype(frame.dtypes.to_dict())
+        stored = stored.drop_duplicates(key, keep='last')
+        # A second cursor, so the fetch of the rows goes on.
+        writer = cursor.connection.cursor()
+        writer.executemany('INSERT OR REPLACE INTO %s VALUES (?, ?)' % digests_table(table),
+                           zip(stored[key].astype(str), row_digests(stored).tolist()))
+        writer.close()
+
+
+def _records(frame):
+    return frame.astype(object).where(frame.notnull(), None).to_numpy().tolist()
+
+
+def upsert_chunk(cursor, chunk, table=TABLE, key=KEY):
+    """Insert the new and replace the changed accounts of `chunk`.
+
+    Returns (inserted, updated, unchanged) counts.
+    """
+    chunk = chunk.drop_duplicates().drop_duplicates(key, keep='last')
+    digests = row_digests(chunk)
+    cursor.execute('CREATE TEMP TABLE IF NOT EXISTS batch_digests ("%s" TEXT PRIMARY KEY, digest INTEGER)' % key)
+    cursor.execute('DELETE FROM batch_digests')
+    cursor.executemany('INSERT INTO batch_digests VALUES (?, ?)', zip(chunk[key].astype(str), digests.tolist()))
+    cursor.execute("""SELECT b."{key}", d."{key}" IS NOT NULL FROM batch_digests AS b
+    LEFT JOIN {digests} AS d ON d."{key}" = b."{key}" WHERE d.digest IS NULL OR d.digest != b.digest"""
+                   .format(key=key, digests=digests_table(table)))
+    changes = dict(cursor.fetchall())
+    if not changes:
+        return 0, 0, len(chunk)
+
+    keep = chunk[key].astype(str).isin(list(changes)).to_numpy()
+    rows = chunk[keep]
+    updated = [(account,) for account, existed in changes.items() if existed]
+    if updated:
+        cursor.executemany('DELETE FROM %s WHERE "%s" = ?' % (table, key), updated)
+    columns = ', '.join('"%s"' % name for name in rows.columns)
+    cursor.executemany('INSERT INTO %s (%s) VALUES (%s)' % (table, columns, ', '.join(['?'] * len(rows.columns))),
+                       _records(rows))
+    cursor.executemany('INSERT OR REPLACE INTO %s VALUES (?, ?)' % digests_table(table),
+                       zip(rows[key].astype(str), digests[keep].tolist()))
+    return len(rows) - len(updated), len(updated), len(chunk) - len(rows)
+
+
+def upsert(chunks, engine, table=TABLE, key=KEY):
+    """Upsert every DataFrame of `chunks` into `table`, in one transaction.
+
+    Returns a dict with the number of inserted, updated and unchanged
+    accounts.
+    """
+    totals = dict(inserted=0, updated=0, unchanged=0)
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        created = False
+        for chunk in chunks:
+            if not created:
+                create_tables(cursor, chunk, table, key)
+                index_table(cursor, chunk, table, key)
+                created = True
+            inserted, updated, unchanged = upsert_chunk(cursor, chunk, table, key)
+            totals['inserted'] += inserted
+            totals['updated'] += updated
+            totals['unchanged'] += unchanged
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+    return totals
+
+
+def upsert_csv(path, engine, table=TABLE, key=KEY, exclude=(), chunksize=CHUNKSIZE):
+    """Stream the customer CSV at `path` into `table`, `chunksize` rows at a time."""
+    chunks = pd.read_csv(path, chunksize=chunksize)
+    return upsert((chunk.drop(list(exclude), axis=1) for chunk in chunks), engine, table, key)
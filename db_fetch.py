@@ -0,0 +1,83 @@
+"""Streaming reads through psycopg2 server-side cursors.
+
+`cursor.fetchall()` on a plain cursor holds the whole result as a list of
+tuples, and `pd.DataFrame(rows, ...)` then copies it once more. The helpers
+below use a named (server-side) cursor instead, so PostgreSQL sends the rows
+`itersize` at a time and only one chunk is held in Python at once.
+
+Named cursors live inside a transaction, so the connection must not be in
+autocommit mode.
+"""
+
+import uuid
+
+import pandas as pd
+
+
+ITERSIZE = 20000
+
+
+def _named_cursor(connection, itersize):
+    cursor = connection.cursor(name='stream_%s' % uuid.uuid4().hex)
+    cursor.itersize = itersize
+    return cursor
+
+
+def iter_rows(connection, query, params=None, itersize=ITERSIZE):
+    """Yield the rows of `query` one at a time, fetching `itersize` per trip."""
+    cursor = _named_cursor(connection, itersize)
+    try:
+        cursor.execute(query, params)
+        for row in cursor:
+            yield row
+    finally:
+        cursor.close()
+
+
+def iter_frames(connection, query, params=None, columns=None, itersize=ITERSIZE):
+    """Yield the result of `query` as DataFrames of at most `itersize` rows.
+
+    Column names default to the ones reported by the database.
+    """
+    cursor = _named_cursor(connection, itersize)
+    try:
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(itersize)
+            if not rows:
+                break
+            if columns is None:
+                columns = [column[0] for column in cursor.description]
+            yield pd.DataFrame.from_records(rows, columns=columns)
+    finally:
+        cursor.close()
+
+
+def iter_record_batches(connection, query, params=None, columns=None, itersize=ITERSIZE):
+    """Like `iter_frames`, but yield pyarrow RecordBatches."""
+    import pyarrow as pa
+
+    for frame in iter_frames(connection, query, params, columns, itersize):
+        yield pa.RecordBatch.from_pandas(frame, preserve_index=False)
+
+
+def read_frame(connection, query, params=None, columns=None, itersize=ITERSIZE):
+    """The whole result of `query` as one DataFrame, built chunk by chunk.
+
+    Only one chunk of raw tuples is alive at a time, instead of the full
+    `fetchall()` list next to the DataFrame copied from it.
+    """
+    frames = list(iter_frames(connection, query, params, columns, itersize))
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+
+def to_csv(connection, query, path, params=None, columns=None, itersize=ITERSIZE):
+    """Export the result of `query` to a CSV file in bounded memory."""
+    written = 0
+    with open(path, 'w') as f:
+        for frame in iter_frames(connection, query, params, columns, itersize):
+            frame.to_csv(f, header=written == 0, index=False)
+            written += len(frame)
+    return written
@@ -0,0 +1,231 @@
+"""Crime counts on a geohash grid, per week, primary type and arrest.
+
+The report only aggregates by police district (Queries #1 to #4) or shows
+individual crimes (Query #5), so a question like "where are the crimes
+concentrated this month compared to last month" meant another scan of
+`crimes` with a new filter. `crime_hotspot_grid` holds the number of crimes
+per:
+
+- cell: the geohash of the crime's longitude and latitude at PRECISION
+  (7 characters, about 150 m x 150 m in Chicago);
+- week: the Monday of the week of the crime;
+- primary_type and arrest.
+
+A geohash is a prefix of the geohashes of the cells inside it, so the same
+table answers any coarser zoom by grouping on `substr(cell, 1, precision)`
+(see `precision_for_zoom`). Like crime_rollups, `refresh` only adds the
+crimes with an `id` above the largest one already in the grid, kept with its
+watermark in `rollup_watermarks`, so crimes reported late are counted too.
+Unlike the rollups, the grid covers every year, not only the recent ones.
+
+The query helpers take crime_queries predicates, which may only use the grid
+columns (`primary_type`, `arrest`), e.g. `crime_queries.primary_type_in`.
+`geo_json` turns cell counts into polygons for a choropleth, in place of the
+district boundaries.
+"""
+
+import datetime
+import math
+
+import boundary_cache
+import crime_queries
+import top_k
+
+
+GRID = 'crime_hotspot_grid'
+PRECISION = 7
+CELL_PIXELS = 16
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+KM_PER_DEGREE = 111.32
+
+
+def create_tables(cursor):
+    """Create the grid and the watermark table if they are missing."""
+    cursor.execute("""CREATE TABLE IF NOT EXISTS rollup_watermarks (
+    name text PRIMARY KEY,
+    last_date timestamp NOT NULL,
+    last_id bigint,
+    since timestamp)""")
+    cursor.execute("""CREATE TABLE IF NOT EXISTS %s (
+    cell text COLLATE "C" NOT NULL,
+    week date NOT NULL,
+    primary_type text NOT NULL,
+    arrest boolean NOT NULL,
+    crimes bigint NOT NULL,
+    PRIMARY KEY (cell, week, primary_type, arrest))""" % GRID)
+    cursor.execute("CREATE INDEX IF NOT EXISTS %s_week_idx ON %s (week)" % (GRID, GRID))
+    cursor.execute("CREATE INDEX IF NOT EXISTS crimes_id_idx ON crimes (id)")
+
+
+def _watermark(cursor):
+    """(latest crime date, last id, since) of the grid, or Nones before the first refresh."""
+    cursor.execute("SELECT last_date, last_id, since from rollup_watermarks where name = %s", [GRID])
+    row = cursor.fetchone()
+    return tuple(row) if row else (None, None, None)
+
+
+def refresh(cursor, since=None):
+    """Add the crimes added to `crimes` since the last refresh to the grid.
+
+    The grid covers every crime dated from `since` (default: all of them);
+    a `since` given on the first run is kept for later refreshes. Returns
+    the number of crimes added. The caller owns the transaction and should
+    commit afterwards.
+    """
+    create_tables(cursor)
+    latest, last_id, fixed_start = _watermark(cursor)
+    if latest is None:
+        fixed_start = since
+
+    cursor.execute("SELECT max(id), max(date) from crimes")
+    max_id, max_date = cursor.fetchone()
+    if max_id is None or (last_id is not None and max_id <= last_id):
+        return 0
+
+    cursor.execute("""WITH added AS (
+    SELECT ST_GeoHash(ST_SetSRID(ST_MakePoint(longitude, latitude), 4326), %d) as cell,
+    date_trunc('week', date)::date as week, coalesce(primary_type, '') as primary_type,
+    coalesce(arrest, false) as arrest, count(*) as crimes
+    from crimes where id > %%s and id <= %%s and date >= %%s and latitude IS NOT NULL and longitude IS NOT NULL
+    GROUP BY 1, 2, 3, 4),
+    upserted AS (INSERT INTO %s SELECT * from added
+    ON CONFLICT (cell, week, primary_type, arrest)
+    DO UPDATE SET crimes = %s.crimes + EXCLUDED.crimes)
+    SELECT coalesce(sum(crimes), 0) from added""" % (PRECISION, GRID, GRID),
+                   [-1 if last_id is None else last_id, max_id, fixed_start or datetime.datetime(1900, 1, 1)])
+    added = int(cursor.fetchone()[0])
+
+    cursor.execute("""INSERT INTO rollup_watermarks VALUES (%s, %s, %s, %s)
+    ON CONFLICT (name) DO UPDATE SET last_date = EXCLUDED.last_date, last_id = EXCLUDED.last_id""",
+                   [GRID, max_date, max_id, fixed_start])
+    return added
+
+
+def rebuild(cursor, since=None):
+    """Drop the grid and build it again from scratch."""
+    create_tables(cursor)
+    cursor.execute("DROP TABLE %s" % GRID)
+    cursor.execute("DELETE from rollup_watermarks where name = %s", [GRID])
+    return refresh(cursor, since)
+
+
+def cell_size(precision):
+    """(width, height) in degrees of a geohash cell of `precision` characters."""
+    bits = 5 * precision
+    return 360.0 / 2 ** ((bits + 1) // 2), 180.0 / 2 ** (bits // 2)
+
+
+def precision_for_zoom(zoom, pixels=CELL_PIXELS):
+    """The finest precision whose cells are at least `pixels` wide at `zoom`."""
+    for precision in range(PRECISION, 0, -1):
+        if cell_size(precision)[0] >= pixels * boundary_cache.pixel_size(zoom):
+            return precision
+    return 1
+
+
+def _where(predicate, start, end):
+    sql, params = predicate[0], tuple(predicate[1])
+    if start is not None:
+        sql += ' and week >= %s'
+        params += (start,)
+    if end is not None:
+        sql += ' and week < %s'
+        params += (end,)
+    return sql, params
+
+
+def _cells(precision):
+    return 'substr(cell, 1, %d)' % min(int(precision), PRECISION)
+
+
+def cell_counts(cursor, precision=PRECISION, predicate=crime_queries.ALL_CRIMES, start=None, end=None):
+    """Number of crimes per cell of `precision`, for the weeks in [start, end)."""
+    where, params = _where(predicate, start, end)
+    query = "SELECT %s, sum(crimes) from %s where %s GROUP BY 1" % (_cells(precision), GRID, where)
+    return dict((cell, int(count)) for cell, count in crime_queries.run(cursor, query, params))
+
+
+def hotspots(cursor, k=10, precision=6, predicate=crime_queries.ALL_CRIMES, start=None, end=None):
+    """(cell, crimes) of the `k` cells with the most crimes, most first."""
+    where, params = _where(predicate, start, end)
+    query = "SELECT %s as cell, sum(crimes) as crimes from %s where %s GROUP BY 1" % (_cells(precision), GRID, where)
+    rows = crime_queries.run(cursor, top_k.ordered_query(query, 'crimes DESC, cell'), params + (k,))
+    return [(cell, int(count)) for cell, count in rows]
+
+
+def trend(cursor, weeks=4, precision=6, predicate=crime_queries.ALL_CRIMES, end=None):
+    """(cell, current, previous) crimes of the last `weeks` weeks before `end`
+    and of the `weeks` weeks before those, largest increase first.
+
+    `end` defaults to the start of the week of the latest crime in the grid
+    (its watermark), so the current period only has complete weeks of data.
+    """
+    if end is None:
+        latest = _watermark(cursor)[0]
+        if latest is None:
+            return []
+        end = latest.date() - datetime.timedelta(days=latest.weekday())
+    middle = end - datetime.timedelta(weeks=weeks)
+    where, params = _where(predicate, middle - datetime.timedelta(weeks=weeks), end)
+    query = """SELECT %s, sum(crimes) FILTER (WHERE week >= %%s), sum(crimes) FILTER (WHERE week < %%s)
+    from %s where %s GROUP BY 1""" % (_cells(precision), GRID, where)
+    rows = crime_queries.run(cursor, query, (middle, middle) + params)
+    rows = [(cell, int(current or 0), int(previous or 0)) for cell, current, previous in rows]
+    return sorted(rows, key=lambda row: (row[2] - row[1], row[0]))
+
+
+def weekly_counts(cursor, cell, predicate=crime_queries.ALL_CRIMES, start=None, end=None):
+    """(week, crimes) of the cells inside the geohash `cell`, by week."""
+    where, params = _where(predicate, start, end)
+    # The C collation of `cell` lets the primary key serve the prefix match.
+    query = "SELECT week, sum(crimes) from %s where cell LIKE %%s and %s GROUP BY week ORDER BY week" % (GRID, where)
+    return [(week, int(count)) for week, count in crime_queries.run(cursor, query, (cell + '%',) + params)]
+
+
+def bounds(cell):
+    """(south, west, north, east) of a geohash."""
+    south, north, west, east = -90.0, 90.0, -180.0, 180.0
+    even = True
+    for char in cell:
+        value = BASE32.index(char)
+        for bit in (16, 8, 4, 2, 1):
+            if even:
+                middle = (west + east) / 2
+                if value & bit:
+                    west = middle
+                else:
+                    east = middle
+            else:
+                middle = (south + north) / 2
+                if value & bit:
+                    south = middle
+                else:
+                    north = middle
+            even = not even
+    return south, west, north, east
+
+
+def area(cell):
+    """Approximate area of a geohash cell in km^2."""
+    south, west, north, east = bounds(cell)
+    latitude = math.radians((south + north) / 2)
+    return (north - south) * KM_PER_DEGREE * (east - west) * KM_PER_DEGREE * math.cos(latitude)
+
+
+def geo_json(counts, name='crimes'):
+    """A FeatureCollection of the cells of `counts` (cell -> count, e.g.
+    `cell_counts`), with the count and the count per km^2 as properties.
+
+    Use it as `geo_data` of a choropleth keyed on 'feature.properties.cell'.
+    """
+    features = []
+    for cell, count in sorted(counts.items()):
+        south, west, north, east = bounds(cell)
+        features.append({
+            'type': 'Feature',
+            'properties': {'cell': cell, name: count, '%s_density' % name: round(count / area(cell), 1)},
+            'geometry': {'type': 'Polygon',
+                         'coordinates': [[[west, south], [east, south], [east, north], [west, north], [west, south]]]},
+        })
+    return {'type': 'FeatureCollection', 'features': features}
@@ -0,0 +1,299 @@
+"""Export the choropleth maps as small pages sharing one boundary file.
+
+Every folium map of the report embeds the district boundaries and all of its
+popup HTML, so the eight maps carry eight copies of the same geometry. In
+export mode each map is written as:
+
+- `boundaries.topojson`, written once for all maps: the district polygons
+  as a TopoJSON topology. Borders shared by two districts are stored once,
+  as arcs simplified with Douglas-Peucker for a zoom level, and the
+  coordinates are quantized to integers and delta encoded;
+- `<name>.json`: the value per district, the color thresholds and the
+  markers with the fields of their popups;
+- `<name>.html`: a Leaflet page that loads both files and joins them on
+  the district number in the browser.
+
+The pages fetch their data, so serve the directory over HTTP (for example
+`python -m http.server`) rather than opening them as files.
+"""
+
+import collections
+import html
+import json
+import math
+import os
+import string
+
+import boundary_cache
+
+
+QUANTIZATION = 100000
+TOPOLOGY_FILE = 'boundaries.topojson'
+OBJECT = 'boundaries'
+
+# ColorBrewer sequential schemes, six classes, as folium uses them.
+COLOR_SCHEMES = {
+    'YlOrRd': ['#ffffb2', '#fed976', '#feb24c', '#fd8d3c', '#f03b20', '#bd0026'],
+    'OrRd': ['#fef0d9', '#fdd49e', '#fdbb84', '#fc8d59', '#e34a33', '#b30000'],
+}
+
+
+def _rings(geometry):
+    if geometry['type'] == 'Polygon':
+        return [geometry['coordinates']]
+    if geometry['type'] == 'MultiPolygon':
+        return geometry['coordinates']
+    return []
+
+
+def _quantize(features, quantization):
+    points = [point for feature in features for polygon in _rings(feature['geometry'])
+              for ring in polygon for point in ring]
+    x0, y0 = min(point[0] for point in points), min(point[1] for point in points)
+    x1, y1 = max(point[0] for point in points), max(point[1] for point in points)
+    kx = (x1 - x0) / (quantization - 1) or 1.0
+    ky = (y1 - y0) / (quantization - 1) or 1.0
+
+    def quantize(ring):
+        quantized = []
+        for point in ring:
+            point = (int(round((point[0] - x0) / kx)), int(round((point[1] - y0) / ky)))
+            if not quantized or quantized[-1] != point:
+                quantized.append(point)
+        if quantized[0] != quantized[-1]:
+            quantized.append(quantized[0])
+        return quantized
+
+    polygons = [[[quantize(ring) for ring in polygon] for polygon in _rings(feature['geometry'])]
+                for feature in features]
+    return polygons, {'scale': [kx, ky], 'translate': [x0, y0]}
+
+
+def _edge(a, b):
+    return (a, b) if a <= b else (b, a)
+
+
+def _split(rings):
+    """Cut closed rings into arcs wherever the set of rings sharing an edge changes.
+
+    Returns the arcs and, per ring, its arc references; a reference `~i`
+    is arc `i` reversed, as in TopoJSON.
+    """
+    owners = collections.defaultdict(set)
+    for number, ring in enumerate(rings):
+        for a, b in zip(ring[:-1], ring[1:]):
+            owners[_edge(a, b)].add(number)
+
+    arcs, index, references = [], {}, []
+    for ring in rings:
+        points = ring[:-1]
+        shared = [frozenset(owners[_edge(a, b)]) for a, b in zip(ring[:-1], ring[1:])]
+        cuts = [i for i in range(len(shared)) if shared[i] != shared[i - 1]]
+        if not cuts:
+            # A ring that is one arc starts at its smallest point, so that the
+            # same ring traced by a neighbour gives the same arc.
+            first = points.index(min(points))
+            pieces = [points[first:] + points[:first + 1]]
+        else:
+            start = cuts[0]
+            rotated = points[start:] + points[:start] + [points[start]]
+            bounds = sorted((cut - start) % len(points) for cut in cuts) + [len(points)]
+            pieces = [rotated[low:high + 1] for low, high in zip(bounds[:-1], bounds[1:])]
+        refs = []
+        for piece in pieces:
+            piece = tuple(piece)
+            if piece in index:
+                refs.append(index[piece])
+            elif piece[::-1] in index:
+                refs.append(~index[piece[::-1]])
+            else:
+                index[piece] = len(arcs)
+                arcs.append(list(piece))
+                refs.append(index[piece])
+        references.append(refs)
+    return arcs, references
+
+
+def _delta(arc):
+    encoded = [list(arc[0])]
+    for previous, point in zip(arc[:-1], arc[1:]):
+        encoded.append([point[0] - previous[0], point[1] - previous[1]])
+    return encoded
+
+
+def topology(features, key='dist_num', zoom=None, quantization=QUANTIZATION):
+    """A TopoJSON topology of `features`, simplified for `zoom` if given.
+
+    Only the `key` property of every feature is kept.
+    """
+    polygons, transform = _quantize(features, quantization)
+    rings = [ring for feature in polygons for polygon in feature for ring in polygon]
+    arcs, references = _split(rings)
+    if zoom is not None:
+        # The tolerance is one pixel, in quantized units.
+        tolerance = boundary_cache.pixel_size(zoom) / max(transform['scale'])
+        # An arc closed on itself is a whole ring and must keep an area; any
+        # other arc only has to keep its end points, shared with other arcs.
+        arcs = [boundary_cache.simplify_ring(arc, tolerance) if arc[0] == arc[-1]
+                else boundary_cache.simplify_line(arc, tolerance) for arc in arcs]
+
+    geometries = []
+    refs = iter(references)
+    for feature, polygons_of_feature in zip(features, polygons):
+        coordinates = [[next(refs) for ring in polygon] for polygon in polygons_of_feature]
+        geometry = {'properties': {key: str(feature['properties'][key])}}
+        if feature['geometry']['type'] == 'Polygon':
+            geometry.update(type='Polygon', arcs=coordinates[0])
+        else:
+            geometry.update(type='MultiPolygon', arcs=coordinates)
+        geometries.append(geometry)
+    return {'type': 'Topology', 'transform': transform,
+            'objects': {OBJECT: {'type': 'GeometryCollection', 'geometries': geometries}},
+            'arcs': [_delta(arc) for arc in arcs]}
+
+
+def write_topology(boundaries, directory, zoom=11, quantization=QUANTIZATION, name=TOPOLOGY_FILE):
+    """Write the shared TopoJSON of `boundaries` (boundary_cache.Boundaries) to `directory`."""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = os.path.join(directory, name)
+    with open(path, 'w') as f:
+        json.dump(topology(boundaries.features, boundaries.key, zoom, quantization), f, separators=(',', ':'))
+    return path
+
+
+def thresholds(values, classes=6):
+    """Upper bounds of `classes` equal width bins, like folium's default scale."""
+    low, high = min(values), max(values)
+    return [low + (high - low) * (i + 1) / float(classes) for i in range(classes - 1)]
+
+
+PAGE = string.Template("""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>$title</title>
+<link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css">
+<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+<script src="https://unpkg.com/topojson-client@3"></script>
+<style>
+html, body, #map { height: 100%; margin: 0; }
+.legend { background: white; padding: 6px 8px; line-height: 18px; }
+.legend i { width: 18px; height: 18px; float: left; margin-right: 8px; opacity: 0.7; }
+</style>
+</head>
+<body>
+<div id="map"></div>
+<script>
+Promise.all([fetch("$topology").then(function (r) { return r.json(); }),
+             fetch("$data").then(function (r) { return r.json(); })]).then(function (loaded) {
+    var topology = loaded[0], data = loaded[1];
+    var map = L.map('map').setView(data.location, data.zoom_start);
+    L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png',
+                {attribution: '&copy; OpenStreetMap contributors'}).addTo(map);
+
+    function color(value) {
+        var i = 0;
+        while (i < data.thresholds.length && value > data.thresholds[i]) { i++; }
+        return data.colors[i];
+    }
+    L.geoJson(topojson.feature(topology, topology.objects["$object"]), {
+        style: function (feature) {
+            var value = data.values[feature.properties[data.key]];
+            return {fillColor: value === undefined ? 'transparent' : color(value), fillOpacity: 0.5,
+                    color: 'black', weight: 1, opacity: 1};
+        }
+    }).addTo(map);
+
+    function escape(text) {
+        return String(text).replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;');
+    }
+    function popup(marker) {
+        var html = marker.lines.map(escape).join('<br>');
+        if (marker.rows) {
+            html += '<table class="table"><tr><th>' + marker.columns.map(escape).join('</th><th>') + '</th></tr>';
+            marker.rows.forEach(function (row) {
+                html += '<tr><td>' + row.map(escape).join('</td><td>') + '</td></tr>';
+            });
+            html += '</table>';
+        }
+        return html;
+    }
+    data.markers.forEach(function (marker) {
+        var layer = marker.radius ? L.circleMarker(marker.location, {radius: marker.radius, color: marker.color})
+                                  : L.marker(marker.location);
+        layer.bindPopup(popup(marker), {maxWidth: 450}).addTo(map);
+    });
+
+    var legend = L.control({position: 'topright'});
+    legend.onAdd = function () {
+        var div = L.DomUtil.create('div', 'legend'), bounds = [data.min].concat(data.thresholds);
+        div.innerHTML = '<b>' + escape(data.legend) + '</b><br>';
+        data.colors.forEach(function (c, i) {
+            div.innerHTML += '<i style="background:' + c + '"></i>' + Math.round(bounds[i]) + '+<br>';
+        });
+        return div;
+    };
+    legend.addTo(map);
+});
+</script>
+</body>
+</html>
+""")
+
+
+class ExportedMap(object):
+    """A choropleth of one value per district, with markers, for export mode."""
+
+    def __init__(self, name, location=(41.8781, -87.6298), zoom_start=11):
+        self.name = name
+        self.location = list(location)
+        self.zoom_start = zoom_start
+        self.key = 'dist_num'
+        self.values = {}
+        self.fill_color = 'YlOrRd'
+        self.legend_name = ''
+        self.markers = []
+
+    def choropleth(self, data, columns, fill_color='YlOrRd', legend_name='', key='dist_num'):
+        """The `columns` = [district, value] of the DataFrame `data`."""
+        self.key = key
+        self.values = dict((str(district), value.item() if hasattr(value, 'item') else value)
+                           for district, value in zip(data[columns[0]], data[columns[1]]))
+        self.fill_color = fill_color
+        self.legend_name = legend_name
+
+    def marker(self, location, lines, rows=None, columns=None, color=None, radius=None):
+        """A marker, or a circle marker if `radius` is given, with a popup of
+        `lines` and an optional table of `rows`."""
+        marker = {'location': [float(location[0]), float(location[1])], 'lines': [str(line) for line in lines]}
+        if rows is not None:
+            marker['rows'] = [[str(value) for value in row] for row in rows]
+            marker['columns'] = list(columns)
+        if radius is not None:
+            marker.update(radius=radius, color=color or '#3388ff')
+        self.markers.append(marker)
+
+    def grid_clusters(self, clusters, colors, label):
+        """Circle markers of `marker_clusters.grid_clusters`, sized by their number of crimes."""
+        for latitude, longitude, value, crimes in clusters:
+            self.marker((latitude, longitude), ['Crimes: %s' % crimes, '%s: %s' % (label, value)],
+                        color=colors.get(value, 'gray'), radius=4 + 3 * math.log10(crimes))
+
+    def data(self):
+        values = list(self.values.values()) or [0]
+        return {'key': self.key, 'values': self.values, 'legend': self.legend_name,
+                'location': self.location, 'zoom_start': self.zoom_start,
+                'min': min(values), 'thresholds': thresholds(values),
+                'colors': COLOR_SCHEMES.get(self.fill_color, COLOR_SCHEMES['YlOrRd']),
+                'markers': self.markers}
+
+    def save(self, directory, topology_file=TOPOLOGY_FILE):
+        """Write `<name>.json` and `<name>.html` to `directory`; returns the page path."""
+        with open(os.path.join(directory, self.name + '.json'), 'w') as f:
+            json.dump(self.data(), f, separators=(',', ':'))
+        page = os.path.join(directory, self.name + '.html')
+        with open(page, 'w') as f:
+            f.write(PAGE.substitute(title=html.escape(self.legend_name or self.name), topology=topology_file,
+                                    data=self.name + '.json', object=OBJECT))
+        return page
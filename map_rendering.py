@@ -0,0 +1,147 @@
+"""Build the folium maps of the report from plain specs, in parallel.
+
+Once the queries are done the report is CPU bound in Python: every station
+popup went through `pd.DataFrame(...).to_html(...)`, and the eight maps were
+built and rendered one after another in one thread. Here:
+
+- popups are formatted with `string.Template`s compiled once at import
+  (`table_popup` gives the same table markup as `to_html`);
+- a map is first described by a MapSpec, which only holds lists, dicts and
+  strings, so it is cheap to build and can be pickled;
+- `render_all` builds the folium maps from their specs in a process pool and
+  writes them straight to HTML files, so the rendering time goes down with
+  the number of cores. Every worker loads the boundaries through
+  boundary_cache, from its pickle, instead of receiving them with each spec.
+
+In a notebook a MapSpec displays as its folium map. The workers are forked
+wherever fork exists (Linux, macOS), so the report script can call
+`render_all` at its top level. Spawned workers (Windows) re-import the
+calling script, so there, call it from a notebook or from code under
+`if __name__ == '__main__'`.
+"""
+
+import html
+import multiprocessing
+import os
+import string
+from concurrent.futures import ProcessPoolExecutor
+
+import folium
+import pandas as pd
+
+import boundary_cache
+import marker_clusters
+
+
+TABLE_CLASSES = 'table table-striped table-hover table-condensed table-responsive'
+
+TABLE = string.Template('<table border="1" class="dataframe $classes">\n'
+                        '  <thead>\n    <tr style="text-align: right;">\n      <th></th>\n$header    </tr>\n'
+                        '  </thead>\n  <tbody>\n$body  </tbody>\n</table>')
+HEADER_CELL = string.Template('      <th>$value</th>\n')
+ROW = string.Template('    <tr>\n      <th>$index</th>\n$cells    </tr>\n')
+CELL = string.Template('      <td>$value</td>\n')
+
+
+def _escape(value):
+    return html.escape(str(value), quote=False)
+
+
+def table(rows, columns, classes=TABLE_CLASSES):
+    """HTML table of `rows`, laid out like `pd.DataFrame(rows, columns=columns).to_html(classes=classes)`."""
+    header = ''.join(HEADER_CELL.substitute(value=_escape(column)) for column in columns)
+    body = ''.join(ROW.substitute(index=index, cells=''.join(CELL.substitute(value=_escape(value)) for value in row))
+                   for index, row in enumerate(rows))
+    return TABLE.substitute(classes=classes, header=header, body=body)
+
+
+def table_popup(title, rows, columns):
+    """`title` followed by the table of `rows`, as in the station popups."""
+    return '%s %s' % (title, table(rows, columns))
+
+
+class MapSpec(object):
+    """Everything needed to build one folium map of the report, picklable."""
+
+    def __init__(self, name, location=(41.8781, -87.6298), zoom_start=11):
+        self.name = name
+        self.location = tuple(location)
+        self.zoom_start = zoom_start
+        self.choropleths = []
+        self.markers = []
+        self.cluster_layers = []
+
+    def choropleth(self, data, columns, fill_color='YlOrRd', legend_name='', key='dist_num', zoom=11, geo_json=None):
+        """A choropleth of the `columns` = [district, value] of the DataFrame `data`.
+
+        The regions are the district boundaries, or the features of
+        `geo_json` (e.g. hotspot_grid.geo_json) if given.
+        """
+        self.choropleths.append({'records': data[list(columns)].values.tolist(), 'columns': list(columns),
+                                 'fill_color': fill_color, 'legend_name': legend_name, 'key': key, 'zoom': zoom,
+                                 'geo_json': geo_json})
+
+    def marker(self, location, popup, max_width=None):
+        self.markers.append({'location': tuple(location), 'popup': popup, 'max_width': max_width})
+
+    def circle_marker(self, location, popup, color='#ff3187', radius=5):
+        self.markers.append({'location': tuple(location), 'popup': popup, 'color': color, 'radius': radius})
+
+    def clusters(self, layers, colors, label):
+        """The zoom layers of `marker_clusters.cluster_layers`."""
+        self.cluster_layers.append((layers, colors, label))
+
+    def to_map(self, boundaries_path='Boundaries.geojson'):
+        """Build the folium map."""
+        folium_map = folium.Map(location=self.location, zoom_start=self.zoom_start)
+        for choropleth in self.choropleths:
+            geo_json = choropleth['geo_json']
+            if geo_json is None:
+                geo_json = boundary_cache.load(boundaries_path, choropleth['key']).geo_json(choropleth['zoom'])
+            folium_map.choropleth(geo_data=geo_json,
+                                  fill_color=choropleth['fill_color'],
+                                  fill_opacity=0.5,
+                                  line_opacity=1,
+                                  data=pd.DataFrame(choropleth['records'], columns=choropleth['columns']),
+                                  key_on='feature.properties.%s' % choropleth['key'],
+                                  columns=choropleth['columns'],
+                                  legend_name=choropleth['legend_name'])
+        for marker in self.markers:
+            if 'radius' in marker:
+                folium.CircleMarker(marker['location'], radius=marker['radius'], color=marker['color'],
+                                    popup=folium.Popup(html=marker['popup'])).add_to(folium_map)
+            else:
+                popup = folium.Popup(html=marker['popup'], max_width=marker['max_width'] or 300)
+                folium.Marker(location=marker['location'], popup=popup).add_to(folium_map)
+        for layers, colors, label in self.cluster_layers:
+            marker_clusters.add_cluster_layers(folium_map, layers, colors, label)
+        return folium_map
+
+    def _repr_html_(self):
+        return self.to_map()._repr_html_()
+
+
+def render(spec, directory, boundaries_path='Boundaries.geojson'):
+    """Build the map of `spec` and save it as `<directory>/<name>.html`; returns the path."""
+    path = os.path.join(directory, spec.name + '.html')
+    spec.to_map(boundaries_path).save(path)
+    return path
+
+
+def render_all(specs, directory, boundaries_path='Boundaries.geojson', workers=None):
+    """Render every MapSpec of `specs` to `directory` in a process pool.
+
+    Returns the paths of the pages by map name. `workers` defaults to the
+    number of CPUs. Workers are forked where the platform allows it, whatever
+    the default start method of this Python is.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    # Parse (or refresh the pickle of) the boundaries once, before the workers read it.
+    for key in set(choropleth['key'] for spec in specs for choropleth in spec.choropleths
+                   if choropleth['geo_json'] is None):
+        boundary_cache.load(boundaries_path, key)
+    context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = dict((spec.name, executor.submit(render, spec, directory, boundaries_path)) for spec in specs)
+        return dict((name, future.result()) for name, future in futures.items())
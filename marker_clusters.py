@@ -0,0 +1,96 @@
+"""Marker clusters for the crime maps, computed on the database.
+
+Query #5 and Requirement #4 used to pull every gun crime into Python and
+add one folium.Marker with its own Popup per crime to a MarkerCluster. That
+does not scale to the full dataset: the page ends up with hundreds of
+thousands of markers. There are two alternatives here:
+
+- 'grid': the database snaps crimes to a grid of CLUSTER_PIXELS wide cells
+  per zoom level with ST_SnapToGrid and only returns one row per cell and
+  category. Memory and page size grow with the number of cells.
+- 'fast': crimes are streamed from a server-side cursor into compact
+  [lat, lon, color, popup] arrays for folium's FastMarkerCluster, which
+  clusters them in the browser.
+"""
+
+import math
+
+import folium
+from folium import plugins
+
+import boundary_cache
+import crime_queries
+import db_fetch
+
+
+CLUSTER_PIXELS = 60
+ZOOM_LEVELS = (11, 13, 15)
+
+FAST_MARKER_CALLBACK = """function (row) {
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {radius: 5, color: row[2]});
+    marker.bindPopup(row[3]);
+    return marker;
+}"""
+
+
+def grid_clusters(cursor, category, predicate=crime_queries.ALL_CRIMES, zoom=11, table='crimes'):
+    """(latitude, longitude, category, crimes) per grid cell and category.
+
+    The cell size is CLUSTER_PIXELS at `zoom`; the position of a cluster is
+    the mean position of its crimes.
+    """
+    query = """SELECT avg(latitude), avg(longitude), %s, count(DISTINCT caseno) from %s where %s
+    GROUP BY ST_SnapToGrid(where_is, %%s), %s""" % (category, table, predicate[0], category)
+    cell = boundary_cache.pixel_size(zoom) * CLUSTER_PIXELS
+    return crime_queries.run(cursor, query, tuple(predicate[1]) + (cell,))
+
+
+def add_grid_clusters(parent, clusters, colors, label):
+    """Add one CircleMarker per cluster, sized by its number of crimes."""
+    for latitude, longitude, value, crimes in clusters:
+        folium.CircleMarker(location=(latitude, longitude),
+                            radius=4 + 3 * math.log10(crimes),
+                            color=colors.get(value, 'gray'),
+                            fill=True,
+                            popup=folium.Popup(html="Crimes: %s <br> %s: %s" % (crimes, label, value))).add_to(parent)
+
+
+def add_fast_clusters(parent, cursor, category, colors, predicate=crime_queries.ALL_CRIMES, table='crimes'):
+    """Stream crimes into a FastMarkerCluster, one compact array per crime."""
+    query = "SELECT DISTINCT ON (caseno) latitude, longitude, %s, district, description, block from %s where %s" % (
+        category, table, predicate[0])
+    if crime_queries.STRICT_PLANS:
+        crime_queries.check_plan(cursor, query, predicate[1])
+    rows = db_fetch.iter_rows(cursor.connection, query, predicate[1])
+    data = [[latitude, longitude, colors.get(value, 'gray'),
+             "District No: %s <br> Description: %s <br> Block: %s" % (district, description, block)]
+            for latitude, longitude, value, district, description, block in rows]
+    plugins.FastMarkerCluster(data, callback=FAST_MARKER_CALLBACK).add_to(parent)
+
+
+def cluster_layers(cursor, category, predicate=crime_queries.ALL_CRIMES, table='crimes', zoom_levels=ZOOM_LEVELS):
+    """[(zoom, grid_clusters(...))] for every zoom level."""
+    return [(zoom, grid_clusters(cursor, category, predicate, zoom, table)) for zoom in zoom_levels]
+
+
+def add_cluster_layers(folium_map, layers, colors, label):
+    """Add every zoom level of `cluster_layers` as its own map layer.
+
+    Only the first one is shown initially; the others can be switched on in
+    the layer control.
+    """
+    for index, (zoom, clusters) in enumerate(layers):
+        layer = folium.FeatureGroup(name='Clusters at zoom %d' % zoom, show=index == 0)
+        add_grid_clusters(layer, clusters, colors, label)
+        layer.add_to(folium_map)
+    folium.LayerControl().add_to(folium_map)
+
+
+def add_clusters(folium_map, cursor, category, colors, predicate=crime_queries.ALL_CRIMES, table='crimes',
+                 mode='grid', label=None, zoom_levels=ZOOM_LEVELS):
+    """Add clustered crimes to `folium_map` in 'grid' or 'fast' mode."""
+    if mode == 'fast':
+        add_fast_clusters(folium_map, cursor, category, colors, predicate, table)
+    else:
+        add_cluster_layers(folium_map, cluster_layers(cursor, category, predicate, table, zoom_levels),
+                           colors, label or category)
@@ -0,0 +1,132 @@
+"""Bitmap index of the BestDeal product flags in trans4cust.
+
+Each market basket question of the BestDeal notebook, e.g. `WHERE
+DellLaptop=1 AND HPPrinter=1 GROUP BY CustomerAge`, used to be a full scan of
+trans4cust. ProductBasket loads the table once and keeps:
+
+- one bitset per product, packed 8 transactions per byte with
+  `numpy.packbits`;
+- ZipCode and CustomerAge dictionary encoded, as small integer codes into a
+  table of distinct values.
+
+A combination of products is then a few vectorized bit operations on the
+bitsets, and grouping it by zip or age is one `bincount` of the codes:
+
+    basket = ProductBasket.from_sql(engine)
+    both = basket['DellLaptop'] & basket['HPPrinter']
+    basket.group_counts(both, 'CustomerAge')
+    basket.group_counts(basket['HPLaptop'] & ~basket['WDexternalHD'], 'CustomerAge', having=100)
+"""
+
+import numpy as np
+import pandas as pd
+
+import bestdeal_ingest
+
+
+DIMENSIONS = ['ZipCode', 'CustomerAge']
+CHUNKSIZE = 100000
+
+_POPCOUNT = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+
+class Selection(object):
+    """The set of transactions of a ProductBasket matching a condition.
+
+    Combine selections with `&` (AND), `|` (OR) and `~` (NOT).
+    """
+
+    def __init__(self, basket, bits):
+        self.basket = basket
+        self.bits = bits
+
+    def __and__(self, other):
+        return Selection(self.basket, self.bits & other.bits)
+
+    def __or__(self, other):
+        return Selection(self.basket, self.bits | other.bits)
+
+    def __invert__(self):
+        # The padding bits past the last transaction must stay cleared.
+        return Selection(self.basket, ~self.bits & self.basket.valid)
+
+    def __len__(self):
+        return int(_POPCOUNT[self.bits].sum(dtype=np.int64))
+
+    def rows(self):
+        """A boolean mask over the transactions."""
+        return np.unpackbits(self.bits, count=self.basket.size).astype(bool)
+
+
+class ProductBasket(object):
+    """Packed product bitsets and dictionary encoded zip codes and ages."""
+
+    def __init__(self, products=bestdeal_ingest.PRODUCTS):
+        self.products = list(products)
+        self.size = 0
+        self.bits = dict((product, np.zeros(0, dtype=np.uint8)) for product in self.products)
+        self.valid = np.zeros(0, dtype=np.uint8)
+        self.dictionaries = dict((dimension, pd.Index([])) for dimension in DIMENSIONS)
+        self.codes = dict((dimension, np.zeros(0, dtype=np.int32)) for dimension in DIMENSIONS)
+
+    @classmethod
+    def from_frame(cls, frame, products=bestdeal_ingest.PRODUCTS):
+        basket = cls(products)
+        basket.append(frame)
+        return basket
+
+    @classmethod
+    def from_sql(cls, engine, table=bestdeal_ingest.TABLE, products=bestdeal_ingest.PRODUCTS,
+                 chunksize=CHUNKSIZE):
+        """Index `table`, read in chunks of `chunksize` transactions."""
+        basket = cls(products)
+        columns = ', '.join(DIMENSIONS + list(products))
+        for chunk in pd.read_sql_query('SELECT %s FROM %s' % (columns, table), engine, chunksize=chunksize):
+            basket.append(chunk)
+        return basket
+
+    def _encode(self, dimension, values):
+        dictionary = self.dictionaries[dimension]
+        new = pd.Index(values).unique().difference(dictionary)
+        if len(new):
+            dictionary = self.dictionaries[dimension] = dictionary.append(new)
+        return dictionary.get_indexer(values).astype(np.int32)
+
+    def _extend(self, bits, flags):
+        # Only the last, partially filled byte has to be unpacked again.
+        used = self.size % 8
+        if used:
+            flags = np.concatenate([np.unpackbits(bits[-1:])[:used].astype(bool), flags])
+            bits = bits[:-1]
+        return np.concatenate([bits, np.packbits(flags)])
+
+    def append(self, frame):
+        """Add the transactions of `frame` to the index."""
+        size = self.size + len(frame)
+        for product in self.products:
+            self.bits[product] = self._extend(self.bits[product], (frame[product].to_numpy() == 1))
+        self.valid = self._extend(self.valid, np.ones(len(frame), dtype=bool))
+        for dimension in DIMENSIONS:
+            self.codes[dimension] = np.concatenate([self.codes[dimension],
+                                                    self._encode(dimension, frame[dimension].to_numpy())])
+        self.size = size
+
+    def __getitem__(self, product):
+        """The transactions that bought `product`."""
+        return Selection(self, self.bits[product])
+
+    def everything(self):
+        """All transactions."""
+        return Selection(self, self.valid)
+
+    def group_counts(self, selection, by='ZipCode', having=None):
+        """Transactions of `selection` per `by` value, sorted by `by`.
+
+        Like `SELECT by, COUNT(*) as num_customers ... GROUP BY by [HAVING
+        COUNT(*) > having] ORDER BY by`.
+        """
+        dictionary = self.dictionaries[by]
+        counts = np.bincount(self.codes[by][selection.rows()], minlength=len(dictionary))
+        keep = counts > (0 if having is None else having)
+        result = pd.DataFrame({by: dictionary[keep], 'num_customers': counts[keep]}, columns=[by, 'num_customers'])
+        return result.sort_values(by=by).reset_index(drop=True)
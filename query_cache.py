@@ -0,0 +1,156 @@
+"""Cache of report query results.
+
+Re-running the report, or tweaking a single map, used to send every query
+to the database again even though the crimes had not changed. QueryCache
+keeps results keyed on the normalized SQL and its parameters:
+
+- in memory, evicting the least recently used entry beyond `max_entries`;
+- optionally on disk, one pickle per entry in `directory`, so the next run
+  of the script starts warm.
+
+An entry is used while it is younger than `ttl` seconds and the source
+tables it reads have not changed. A table's state is a cheap token query,
+e.g. `max(id)` of `crimes` or the rollup watermark, looked up at most once
+per `token_ttl` seconds.
+"""
+
+import collections
+import hashlib
+import os
+import pickle
+import re
+import threading
+import time
+
+
+# `since` changes on a rebuild that ends at the same crime id.
+ROLLUP_WATERMARK = "SELECT last_id, since from rollup_watermarks where name = 'recent_crimes'"
+
+SOURCES = {
+    'crimes': 'SELECT max(id) from crimes',
+    'recent_crimes': ROLLUP_WATERMARK,
+    'crime_rollup': ROLLUP_WATERMARK,
+    'crime_block_rollup': ROLLUP_WATERMARK,
+    'crime_hotspot_grid': "SELECT last_id, since from rollup_watermarks where name = 'crime_hotspot_grid'",
+    'police_stations': 'SELECT count(*) from police_stations',
+}
+
+_TOKENS = re.compile(r"'(?:[^']|'')*'|\s+")
+_TABLES = re.compile(r'\b(?:from|join)\s+([a-z_][a-z0-9_]*)', re.IGNORECASE)
+
+
+def normalize(query):
+    """Collapse whitespace outside of string literals."""
+    return _TOKENS.sub(lambda match: match.group(0) if match.group(0).startswith("'") else ' ', query).strip()
+
+
+def source_tables(query):
+    """Names of the tables a query reads from."""
+    return sorted(set(table.lower() for table in _TABLES.findall(query)))
+
+
+def _execute(cursor, query, params):
+    cursor.execute(query, params)
+    return cursor.fetchall()
+
+
+class QueryCache(object):
+    """LRU cache of query results with TTLs and source-table invalidation."""
+
+    def __init__(self, max_entries=256, ttl=24 * 3600, directory=None, sources=SOURCES, token_ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.directory = directory
+        self.sources = sources
+        self.token_ttl = token_ttl
+        self.entries = collections.OrderedDict()
+        self.tokens = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, query, params=None):
+        return hashlib.sha1(('%s\0%r' % (normalize(query), params)).encode('utf-8')).hexdigest()
+
+    def token(self, cursor, query):
+        """The current state of every known source table of `query`."""
+        now = time.time()
+        token = []
+        for table in source_tables(query):
+            if table not in self.sources:
+                continue
+            with self.lock:
+                checked = self.tokens.get(table)
+            if checked is None or now - checked[0] > self.token_ttl:
+                cursor.execute(self.sources[table])
+                # The whole row: there is none before the first refresh.
+                checked = (now, cursor.fetchone())
+                with self.lock:
+                    self.tokens[table] = checked
+            token.append((table, checked[1]))
+        return tuple(token)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pickle')
+
+    def _lookup(self, key):
+        with self.lock:
+            if key in self.entries:
+                entry = self.entries.pop(key)
+                self.entries[key] = entry
+                return entry
+        if self.directory:
+            try:
+                with open(self._path(key), 'rb') as f:
+                    return pickle.load(f)
+            except (IOError, OSError, EOFError, pickle.UnpicklingError):
+                pass
+        return None
+
+    def _remember(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def _store(self, key, entry):
+        self._remember(key, entry)
+        if self.directory:
+            with open(self._path(key), 'wb') as f:
+                pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+
+    def fetch(self, cursor, query, params=None, execute=_execute):
+        """Rows of `query`, from the cache or by calling `execute`."""
+        key = self.key(query, params)
+        token = self.token(cursor, query)
+        entry = self._lookup(key)
+        if entry is not None and entry[1] == token and time.time() - entry[0] < self.ttl:
+            self._remember(key, entry)
+            with self.lock:
+                self.hits += 1
+            return entry[2]
+        rows = execute(cursor, query, params)
+        self._store(key, (time.time(), token, rows))
+        with self.lock:
+            self.misses += 1
+        return rows
+
+    def invalidate(self, table=None):
+        """Forget the cached token of `table` (or of all tables)."""
+        with self.lock:
+            if table is None:
+                self.tokens.clear()
+            else:
+                self.tokens.pop(table, None)
+
+    def clear(self):
+        """Drop every cached result, in memory and on disk."""
+        with self.lock:
+            self.entries.clear()
+            self.tokens.clear()
+        if self.directory:
+            for name in os.listdir(self.directory):
+                if name.endswith('.pickle'):
+                    os.remove(os.path.join(self.directory, name))
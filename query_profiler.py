@@ -0,0 +1,141 @@
+"""Per-section timings of the crimes report.
+
+The only measurement of the report used to be "roughly 25 minutes" for the
+whole script. A Profiler splits a run into named sections (one per query or
+map) and records for each of them:
+
+- every statement run through `crime_queries.run`: wall time, rows and the
+  approximate bytes received (the size of the values as text, which is what
+  the PostgreSQL text protocol sends);
+- the wall time of the whole section, so that the time spent in Python
+  building DataFrames and folium markers is the difference;
+- optionally, for statements slower than `explain_slower_than` seconds, the
+  `EXPLAIN (ANALYZE, BUFFERS)` plan. ANALYZE runs the statement once more,
+  so only enable it when looking for the reason a query is slow.
+
+`write_json` and `write_csv` save the summary of a run, to compare runs and
+decide which queries deserve an index or a rollup.
+"""
+
+import collections
+import csv
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+import query_cache
+
+
+EXPLAIN = 'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) '
+QUERY_LENGTH = 200
+
+_FIELDS = ['section', 'statements', 'rows', 'bytes', 'query_seconds', 'wall_seconds', 'python_seconds']
+
+
+def _text_size(rows):
+    return sum(len(str(value)) for row in rows for value in row if value is not None)
+
+
+class Profiler(object):
+    """Statement and section timings of one report run."""
+
+    def __init__(self, explain_slower_than=None):
+        self.explain_slower_than = explain_slower_than
+        self.statements = []
+        self.sections = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.current = None
+        self.started = None
+
+    def _section_name(self):
+        return getattr(self.local, 'section', None) or self.current or 'unnamed'
+
+    def _totals(self, name):
+        with self.lock:
+            if name not in self.sections:
+                self.sections[name] = dict((field, 0) for field in _FIELDS[1:])
+            return self.sections[name]
+
+    def execute(self, cursor, query, params=None):
+        """Run `query` on `cursor`, fetch all rows and record the statement."""
+        start = time.time()
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        seconds = time.time() - start
+        record = {'section': self._section_name(), 'query': query_cache.normalize(query)[:QUERY_LENGTH],
+                  'seconds': seconds, 'rows': len(rows), 'bytes': _text_size(rows)}
+        if self.explain_slower_than is not None and seconds > self.explain_slower_than:
+            cursor.execute(EXPLAIN + query, params)
+            plan = cursor.fetchone()[0]
+            record['plan'] = plan if isinstance(plan, list) else json.loads(plan)
+        totals = self._totals(record['section'])
+        with self.lock:
+            self.statements.append(record)
+            totals['statements'] += 1
+            totals['rows'] += record['rows']
+            totals['bytes'] += record['bytes']
+            totals['query_seconds'] += seconds
+        return rows
+
+    def _close(self, name, seconds):
+        totals = self._totals(name)
+        with self.lock:
+            totals['wall_seconds'] += seconds
+            totals['python_seconds'] = max(totals['wall_seconds'] - totals['query_seconds'], 0.0)
+
+    @contextmanager
+    def section(self, name):
+        """Attribute everything run in this block, in this thread, to `name`."""
+        previous = getattr(self.local, 'section', None)
+        self.local.section = name
+        start = time.time()
+        try:
+            yield
+        finally:
+            self._close(name, time.time() - start)
+            self.local.section = previous
+
+    def wrap(self, name, query):
+        """`query(cursor)` running in section `name`, for report_runner."""
+        def profiled(cursor):
+            with self.section(name):
+                return query(cursor)
+        return profiled
+
+    def wrap_all(self, queries):
+        """Every `name -> query` of report_runner.run_queries in its own section."""
+        return dict((name, self.wrap(name, query)) for name, query in queries.items())
+
+    def enter(self, name):
+        """End the current top level section and start `name`.
+
+        Meant for a script that runs cell after cell: call it at the top of
+        every cell instead of indenting the cell under `section`.
+        """
+        self.finish()
+        self.current = name
+        self.started = time.time()
+
+    def finish(self):
+        """End the current top level section, if any."""
+        if self.current is not None:
+            self._close(self.current, time.time() - self.started)
+            self.current = None
+
+    def summary(self):
+        """One row per section, in the order the sections first ran."""
+        with self.lock:
+            return [dict(totals, section=name) for name, totals in self.sections.items()]
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump({'sections': self.summary(), 'statements': self.statements}, f, indent=1, default=str)
+
+    def write_csv(self, path):
+        with open(path, 'w') as f:
+            writer = csv.DictWriter(f, _FIELDS)
+            writer.writeheader()
+            for row in self.summary():
+                writer.writerow(row)
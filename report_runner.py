@@ -0,0 +1,62 @@
+"""Run the independent report queries concurrently over a connection pool.
+
+The report sections (district totals, violent crimes, gun crimes, arrests,
+location types, ...) do not depend on each other, but used to run one after
+another on a single cursor. Here every query is a function of a cursor; each
+one runs in its own thread on its own pooled connection, so the report takes
+about as long as its slowest query rather than the sum of all of them.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from psycopg2 import pool
+
+
+def connect_pool(maxconn=8, **dsn):
+    """A thread-safe pool of up to `maxconn` connections to `dsn`."""
+    return pool.ThreadedConnectionPool(1, maxconn, **dsn)
+
+
+def run_on_pool(connection_pool, query):
+    """Run `query(cursor)` on a pooled connection and hand the connection back."""
+    connection = connection_pool.getconn()
+    try:
+        cursor = connection.cursor()
+        try:
+            result = query(cursor)
+        finally:
+            cursor.close()
+        connection.commit()
+        return result
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection_pool.putconn(connection)
+
+
+def iter_results(connection_pool, queries, workers=None):
+    """Yield (name, result) for every `name -> query` as soon as it finishes.
+
+    `workers` defaults to `connection_pool.maxconn`; more threads than
+    connections would only wait for the pool.
+    """
+    with ThreadPoolExecutor(max_workers=workers or connection_pool.maxconn) as executor:
+        futures = dict((executor.submit(run_on_pool, connection_pool, query), name)
+                       for name, query in queries.items())
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def run_queries(connection_pool, queries, on_result=None, workers=None):
+    """Run all `queries` concurrently and return their results by name.
+
+    `on_result(name, result)` is called in the calling thread as each result
+    arrives, e.g. to build a map while the other queries are still running.
+    """
+    results = {}
+    for name, result in iter_results(connection_pool, queries, workers):
+        results[name] = result
+        if on_result is not None:
+            on_result(name, result)
+    return results
@@ -0,0 +1,149 @@
+"""Helpers for the Walmart weekly sales analysis in PostgreSQL_Retailer_Data.ipynb."""
+
+import pandas as pd
+
+import db_fetch
+import top_k
+
+
+SALES_COLUMNS = ['Store', 'Dept', 'Date', 'Weekly_Sales', 'IsHoliday']
+FEATURE_COLUMNS = ['Unemployment', 'Temperature']
+
+
+def enrich_with_features(sales, features, columns=FEATURE_COLUMNS):
+    """`sales` with the `columns` of `features` for the same (Store, Date).
+
+    One hash join on (Store, Date) instead of scanning `features` twice per
+    sales row, so it stays linear on the full weekly_sales table. Like the
+    row-by-row lookup it replaces, the first feature row of a (Store, Date)
+    wins, and the order and index of `sales` are kept.
+    """
+    lookup = features[['Store', 'Date'] + list(columns)].drop_duplicates(['Store', 'Date'])
+    enriched = sales.merge(lookup, on=['Store', 'Date'], how='left', validate='many_to_one')
+    enriched.index = sales.index
+    return enriched
+
+
+SALES_WITH_FEATURES = """SELECT w.Store, w.Dept, w.Date, w.Weekly_Sales, w.IsHoliday, f.Unemployment, f.Temperature
+from weekly_sales as w LEFT JOIN features as f ON f.Store = w.Store AND f.Date = w.Date"""
+
+
+def read_sales_with_features(connection, where='TRUE', params=None):
+    """weekly_sales joined to the unemployment and temperature in SQL."""
+    return db_fetch.read_frame(connection, SALES_WITH_FEATURES + ' where ' + where, params,
+                               columns=SALES_COLUMNS + FEATURE_COLUMNS)
+
+
+def top_weekly_sales(connection, k=500, per=None, where='TRUE', params=None):
+    """The `k` largest weekly sales, or the `k` largest of every `per` group.
+
+    `per` is a column, e.g. 'Store' or 'Dept'. PostgreSQL returns only those
+    rows (ORDER BY ... LIMIT k, or row_number() per group), largest first;
+    with `per`, the frame has a `Rank` column and is ordered by group.
+    """
+    query = 'SELECT %s from weekly_sales where %s' % (', '.join(SALES_COLUMNS), where)
+    params = tuple(params or ()) + (k,)
+    if per is None:
+        return db_fetch.read_frame(connection, top_k.ordered_query(query, 'Weekly_Sales DESC'), params,
+                                   columns=SALES_COLUMNS)
+    query = top_k.ranked_query(query, 'Weekly_Sales DESC', per, SALES_COLUMNS)
+    return db_fetch.read_frame(connection, query, params, columns=SALES_COLUMNS + ['Rank'])
+
+
+def stream_top_weekly_sales(connection, k=500, per=None, where='TRUE', params=None):
+    """`top_weekly_sales` computed client side, over a streamed cursor.
+
+    For sources that cannot rank in SQL: every row of weekly_sales is read,
+    but only `k` rows (per group) are held at a time.
+    """
+    query = 'SELECT %s from weekly_sales where %s' % (', '.join(SALES_COLUMNS), where)
+    rows = db_fetch.iter_rows(connection, query, params)
+    sales = SALES_COLUMNS.index('Weekly_Sales')
+    if per is None:
+        return pd.DataFrame.from_records(top_k.largest(rows, k, key=lambda row: row[sales]), columns=SALES_COLUMNS)
+    group = SALES_COLUMNS.index(per)
+    ranked = top_k.largest_per(rows, k, key=lambda row: row[sales], group=lambda row: row[group])
+    records = [row + (rank,) for name in sorted(ranked) for rank, row in enumerate(ranked[name], 1)]
+    return pd.DataFrame.from_records(records, columns=SALES_COLUMNS + ['Rank'])
+
+
+DIMENSIONS = ['Store', 'Dept', 'Date']
+GROUPING_BITS = {'Store': 4, 'Dept': 2, 'Date': 1}
+
+
+def sales_cube(connection, where='TRUE', params=None):
+    """Total weekly sales for every grouping of Store, Dept and Date.
+
+    One `GROUP BY CUBE(Store, Dept, Date)` scan of weekly_sales answers all
+    of the notebook's GROUP BY, ROLLUP and CUBE queries; the views below
+    slice it. `Grouping` is GROUPING(Store, Dept, Date): a bit is set for
+    every dimension that is rolled up in that row, so a NULL Store or Dept
+    in the data is never mistaken for a subtotal.
+    """
+    query = """SELECT Store, Dept, Date, sum(Weekly_Sales), GROUPING(Store, Dept, Date)
+    from weekly_sales where %s GROUP BY CUBE(Store, Dept, Date)""" % where
+    cube = db_fetch.read_frame(connection, query, params, columns=DIMENSIONS + ['Total', 'Grouping'])
+    cube['Total'] = cube['Total'].astype(float)
+    return cube
+
+
+def _rolled_up(dims):
+    return sum(bit for dim, bit in GROUPING_BITS.items() if dim not in dims)
+
+
+def _subsets(dims):
+    subsets = [[]]
+    for dim in dims:
+        subsets += [subset + [dim] for subset in subsets]
+    return subsets
+
+
+def _select(cube, groupings, dims):
+    rows = cube[cube['Grouping'].isin([_rolled_up(grouping) for grouping in groupings])]
+    return rows[list(dims) + ['Total', 'Grouping']]
+
+
+def group_view(cube, dims):
+    """The rows of `GROUP BY dims`, with integer Store and Dept."""
+    view = _select(cube, [dims], dims).drop('Grouping', axis=1)
+    for dim in dims:
+        if dim != 'Date':
+            view[dim] = view[dim].astype(int)
+    return view.sort_values(by=list(dims))
+
+
+def rollup_view(cube, dims):
+    """The rows of `GROUP BY ROLLUP(dims)`."""
+    return _select(cube, [dims[:length] for length in range(len(dims) + 1)], dims)
+
+
+def cube_view(cube, dims):
+    """The rows of `GROUP BY CUBE(dims)`."""
+    return _select(cube, _subsets(dims), dims)
+
+
+def for_date(cube, date):
+    """The cube of `WHERE Date = date`, derived from the cube of all dates.
+
+    With a single date, every grouping that rolls Date up has the same
+    totals as the same grouping by Date.
+    """
+    rows = cube[(cube['Grouping'] & GROUPING_BITS['Date'] == 0) & (cube['Date'] == date)]
+    rolled = rows.copy()
+    rolled['Date'] = pd.NaT
+    rolled['Grouping'] = rolled['Grouping'] | GROUPING_BITS['Date']
+    return pd.concat([rows, rolled], ignore_index=True)
+
+
+def pretty(view, dims):
+    """`view` sorted by `dims`, with rolled up dimensions shown as blanks."""
+    view = view.sort_values(by=list(dims), na_position='last')
+    table = view[list(dims) + ['Total']].copy()
+    for dim in dims:
+        rolled = (view['Grouping'] & GROUPING_BITS[dim]) != 0
+        if dim == 'Date':
+            values = view[dim].dt.date
+        else:
+            values = view[dim].fillna(-1).astype(int)
+        table[dim] = values.astype(object).where(~rolled, '')
+    return table
@@ -0,0 +1,181 @@
+"""Assign points to the regions of a boundary file locally.
+
+The crime density of Query #4 and Requirement #2 relies on the district
+stored on every crime row; any other set of regions (a re-districting, beats,
+wards, a hand drawn polygon) needed a new PostGIS query over the whole crimes
+table. RegionIndex does the spatial join in numpy instead, so it can run on
+an extract, away from the shared database server.
+
+The index is a uniform grid over the bounding box of the regions:
+
+- a cell that no boundary edge touches lies entirely inside one region (or
+  outside all of them), found once by testing its center, so the points in
+  it are assigned by a lookup;
+- for the points of the other cells, the candidate regions are the ones
+  whose edges touch the cell, and each is tested with an even-odd ray cast
+  that only looks at the edges crossing the point's grid row.
+
+Holes and multi-polygons need no special case under the even-odd rule.
+Regions are assumed not to overlap; a point on a shared border goes to one
+of them.
+"""
+
+import numpy as np
+import pandas as pd
+
+import boundary_cache
+
+
+CELLS = 512
+
+
+def _rings(geometry):
+    if geometry['type'] == 'Polygon':
+        return geometry['coordinates']
+    if geometry['type'] == 'MultiPolygon':
+        return [ring for polygon in geometry['coordinates'] for ring in polygon]
+    return []
+
+
+class RegionIndex(object):
+    """A grid index over the polygons of a boundary file."""
+
+    def __init__(self, features, key='dist_num', cells=CELLS):
+        self.key = key
+        self.keys = [str(feature['properties'][key]) for feature in features]
+        edges = []
+        for region, feature in enumerate(features):
+            for ring in _rings(feature['geometry']):
+                ring = np.asarray(ring, dtype=np.float64)[:, :2]
+                if len(ring) > 1:
+                    edges.append(np.column_stack([ring[:-1], ring[1:], np.full(len(ring) - 1, region)]))
+        edges = np.concatenate(edges) if edges else np.zeros((0, 5))
+        self.x0, self.y0 = min(edges[:, 0].min(), edges[:, 2].min()), min(edges[:, 1].min(), edges[:, 3].min())
+        width = max(edges[:, 0].max(), edges[:, 2].max()) - self.x0
+        height = max(edges[:, 1].max(), edges[:, 3].max()) - self.y0
+        self.cells = cells
+        self.width = (width or 1.0) / cells
+        self.height = (height or 1.0) / cells
+
+        # Cells touched by an edge, and their regions: every edge is cut into
+        # pieces no longer than a cell, each of which touches at most 2 x 2 cells.
+        pieces = np.maximum(np.ceil(np.maximum(np.abs(edges[:, 2] - edges[:, 0]) / self.width,
+                                               np.abs(edges[:, 3] - edges[:, 1]) / self.height)), 1).astype(np.int64)
+        edge_ids = np.repeat(np.arange(len(edges)), pieces)
+        step = np.arange(pieces.sum()) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+        start, stop = step / pieces[edge_ids], (step + 1) / pieces[edge_ids]
+        piece = edges[edge_ids]
+        xs = [piece[:, 0] + (piece[:, 2] - piece[:, 0]) * t for t in (start, stop)]
+        ys = [piece[:, 1] + (piece[:, 3] - piece[:, 1]) * t for t in (start, stop)]
+        touched = np.unique(np.concatenate([
+            np.column_stack([self._row(y) * cells + self._column(x), piece[:, 4].astype(np.int64)])
+            for x in (np.minimum(*xs), np.maximum(*xs)) for y in (np.minimum(*ys), np.maximum(*ys))]), axis=0)
+        self.boundary_cells, self.boundary_regions = touched[:, 0], touched[:, 1]
+
+        # Horizontal edges never cross a horizontal ray.
+        edges = edges[edges[:, 1] != edges[:, 3]]
+        self.x1, self.y1, self.x2, self.y2 = edges[:, 0], edges[:, 1], edges[:, 2], edges[:, 3]
+        self.edge_regions = edges[:, 4].astype(np.int64)
+
+        # Every edge is listed under each grid row its y range overlaps.
+        low = self._row(np.minimum(self.y1, self.y2))
+        high = self._row(np.maximum(self.y1, self.y2))
+        spans = high - low + 1
+        edge_ids = np.repeat(np.arange(len(spans)), spans)
+        rows = np.repeat(low, spans) + (np.arange(spans.sum()) - np.repeat(np.cumsum(spans) - spans, spans))
+        order = np.argsort(rows, kind='stable')
+        self.row_edges = edge_ids[order]
+        self.row_starts = np.searchsorted(rows[order], np.arange(cells + 1))
+
+        # The single owner, or -1, of every cell no edge touches.
+        self.owners = np.full(cells * cells, -1, dtype=np.int64)
+        interior = np.setdiff1d(np.arange(cells * cells), self.boundary_cells)
+        centers_x = self.x0 + (interior % cells + 0.5) * self.width
+        centers_y = self.y0 + (interior // cells + 0.5) * self.height
+        for region in range(len(self.keys)):
+            inside = self._inside(centers_x, centers_y, region)
+            self.owners[interior[inside]] = region
+
+    @classmethod
+    def from_boundaries(cls, boundaries, cells=CELLS):
+        return cls(boundaries.features, boundaries.key, cells)
+
+    def _row(self, y):
+        return np.clip(((np.asarray(y) - self.y0) // self.height).astype(np.int64), 0, self.cells - 1)
+
+    def _column(self, x):
+        return np.clip(((np.asarray(x) - self.x0) // self.width).astype(np.int64), 0, self.cells - 1)
+
+    def _inside(self, x, y, region):
+        """Even-odd test of the points (x, y) against one region."""
+        inside = np.zeros(len(x), dtype=bool)
+        rows = self._row(y)
+        for row in np.unique(rows):
+            edges = self.row_edges[self.row_starts[row]:self.row_starts[row + 1]]
+            edges = edges[self.edge_regions[edges] == region]
+            if not len(edges):
+                continue
+            points = np.nonzero(rows == row)[0]
+            px, py = x[points, None], y[points, None]
+            x1, y1, x2, y2 = self.x1[edges], self.y1[edges], self.x2[edges], self.y2[edges]
+            spans = (y1 > py) != (y2 > py)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                crossing = px < x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+            inside[points] = (spans & crossing).sum(axis=1) % 2 == 1
+        return inside
+
+    def assign(self, longitude, latitude):
+        """The region number of every point, or -1 outside all regions."""
+        x = np.asarray(longitude, dtype=np.float64)
+        y = np.asarray(latitude, dtype=np.float64)
+        regions = np.full(len(x), -1, dtype=np.int64)
+        known = np.isfinite(x) & np.isfinite(y)
+        known &= (x >= self.x0) & (x <= self.x0 + self.cells * self.width)
+        known &= (y >= self.y0) & (y <= self.y0 + self.cells * self.height)
+        points = np.nonzero(known)[0]
+        cells = self._row(y[points]) * self.cells + self._column(x[points])
+        regions[points] = self.owners[cells]
+
+        on_boundary = np.isin(cells, self.boundary_cells)
+        points, cells = points[on_boundary], cells[on_boundary]
+        for region in np.unique(self.boundary_regions):
+            candidates = np.isin(cells, self.boundary_cells[self.boundary_regions == region])
+            candidates &= regions[points] == -1
+            tested = points[candidates]
+            regions[tested[self._inside(x[tested], y[tested], region)]] = region
+        return regions
+
+    def regions(self, longitude, latitude):
+        """The region key of every point, NaN outside all regions."""
+        return pd.Categorical.from_codes(self.assign(longitude, latitude), categories=self.keys)
+
+    def counts(self, longitude, latitude):
+        """Number of points per region, as an array aligned with `keys`."""
+        regions = self.assign(longitude, latitude)
+        return np.bincount(regions[regions >= 0], minlength=len(self.keys))
+
+    def count_frames(self, frames, longitude='longitude', latitude='latitude'):
+        """Points per region over a stream of DataFrames, e.g. `db_fetch.iter_frames`."""
+        counts = np.zeros(len(self.keys), dtype=np.int64)
+        for frame in frames:
+            counts += self.counts(frame[longitude].to_numpy(), frame[latitude].to_numpy())
+        return counts
+
+
+def load(path='Boundaries.geojson', key='dist_num', cells=CELLS):
+    """RegionIndex of a boundary file, parsed through boundary_cache."""
+    return RegionIndex.from_boundaries(boundary_cache.load(path, key), cells)
+
+
+def density(boundaries, counts, name='crimes'):
+    """Points per region, region area and points per km^2 (100 hectares).
+
+    `counts` are aligned with the features of `boundaries`, as returned by
+    RegionIndex.counts or count_frames.
+    """
+    keys = [str(feature['properties'][boundaries.key]) for feature in boundaries.features]
+    result = pd.DataFrame({boundaries.key: keys, name: counts,
+                           'area_inHectares': [boundaries.areas[key] for key in keys]},
+                          columns=[boundaries.key, name, 'area_inHectares'])
+    result['%s_density' % name] = round(result[name] / (result['area_inHectares'] / 100))
+    return result
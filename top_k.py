@@ -0,0 +1,65 @@
+"""Top-k selection without sorting or holding the whole input.
+
+Taking the 500 largest weekly sales used to mean reading every row of
+weekly_sales into a DataFrame, sorting all of it and slicing `[:500]`. Two
+ways to do it in O(k) memory instead:
+
+- in the database: `ordered_query` appends `ORDER BY ... LIMIT k`, which
+  PostgreSQL runs as a top-N heapsort (or an index scan) and only sends k
+  rows; `ranked_query` keeps the first k rows of every partition (per store,
+  per department, per district) with `row_number()`;
+- in Python, over a streamed cursor or any iterable of rows: `largest` and
+  `largest_per` keep bounded heaps, O(N log k) time.
+
+The LIMIT / rank bound is a `%s` parameter, to be passed after the
+parameters of the query itself.
+"""
+
+import heapq
+import itertools
+
+
+RANK = 'top_k_rank'
+
+
+def ordered_query(query, order_by):
+    """`query` with its first k rows by `order_by`; k is the last parameter."""
+    return '%s ORDER BY %s LIMIT %%s' % (query, order_by)
+
+
+def ranked_query(query, order_by, partition_by, columns):
+    """The first k rows by `order_by` of every `partition_by` group of `query`.
+
+    `columns` are the output columns of `query`; the result has them plus
+    the rank (1 to k) in its group, ordered by group and rank.
+    """
+    columns = ', '.join(columns)
+    return """SELECT {columns}, {rank} from
+    (SELECT {columns}, row_number() OVER (PARTITION BY {partition_by} ORDER BY {order_by}) as {rank}
+    from ({query}) as unranked) as ranked
+    where {rank} <= %s ORDER BY {partition_by}, {rank}""".format(
+        columns=columns, rank=RANK, partition_by=partition_by, order_by=order_by, query=query)
+
+
+def largest(rows, k, key):
+    """The `k` rows of `rows` with the largest `key(row)`, largest first.
+
+    Ties keep the row that came first, like a stable descending sort.
+    """
+    return heapq.nlargest(k, rows, key=key)
+
+
+def largest_per(rows, k, key, group):
+    """`largest` of every `group(row)` of `rows`, as a dict of lists."""
+    heaps = {}
+    counter = itertools.count()
+    for row in rows:
+        # The counter breaks ties in favor of earlier rows and keeps rows
+        # themselves out of the comparisons.
+        item = (key(row), -next(counter), row)
+        heap = heaps.setdefault(group(row), [])
+        if len(heap) < k:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+    return dict((name, [row for _, _, row in sorted(heap, reverse=True)]) for name, heap in heaps.items())